@@ -1,2 +1,3 @@
+from . import controllers
 from . import models
 from .post_init_hook import init_apix_data
@@ -21,7 +21,7 @@
 {
     "name": "APIX Connector",
     "summary": "APIX EDI connector for receiving and sending eInvoices",
-    "version": "17.0.1.0.2",
+    "version": "17.0.1.1.0",
     "category": "Connector",
     "website": "https://github.com/tawasta/connector-apix",
     "author": "Futural",
@@ -41,10 +41,13 @@
     "post_init_hook": "init_apix_data",
     "data": [
         "data/ir_cron.xml",
+        "data/queue_job_data.xml",
         "security/ir.model.access.csv",
         "views/account_invoice_form.xml",
         "views/apix_backend_form.xml",
         "views/apix_backend_menu.xml",
+        "views/apix_inbox_document_views.xml",
+        "views/apix_outbox_views.xml",
     ],
     "demo": [],
 }
@@ -0,0 +1,24 @@
+from odoo import http
+from odoo.http import request
+from odoo.tools import consteq
+
+
+class ApixMetricsController(http.Controller):
+    @http.route("/apix/metrics", type="http", auth="public", methods=["GET"])
+    def metrics(self, token=None, **kwargs):
+        # Prometheus metrics. Enabled by setting a token in the system
+        # parameter "connector_apix.metrics_token"
+        metrics_token = (
+            request.env["ir.config_parameter"]
+            .sudo()
+            .get_param("connector_apix.metrics_token")
+        )
+        # Not configured looks the same as a wrong token
+        if not metrics_token or not consteq(token or "", metrics_token):
+            return request.not_found()
+
+        body = request.env["apix.call"].sudo()._get_prometheus_metrics()
+
+        return request.make_response(
+            body, headers=[("Content-Type", "text/plain; version=0.0.4")]
+        )
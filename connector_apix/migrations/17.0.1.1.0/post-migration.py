@@ -0,0 +1,22 @@
+from odoo import SUPERUSER_ID, api
+
+
+def migrate(cr, version):
+    # The cron data is not updated, so the hourly fetch cron of earlier
+    # versions is moved to the 15 minute interval here. A changed
+    # interval is kept as it is
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    cron = env.ref(
+        "connector_apix.ir_cron_apix_purchase_invoice_import",
+        raise_if_not_found=False,
+    )
+    if cron and (cron.interval_number, cron.interval_type) == (1, "hours"):
+        cron.write({"interval_number": 15, "interval_type": "minutes"})
+
+    # The single invoice download job was replaced by the batched stages
+    job_function = env.ref(
+        "connector_apix.job_function_apix_backend_download_invoice",
+        raise_if_not_found=False,
+    )
+    if job_function:
+        job_function.unlink()
@@ -1,4 +1,9 @@
 from . import apix_binding
+from . import apix_call
+from . import apix_endpoint
+from . import apix_inbox_document
+from . import apix_outbox
+from . import apix_pdf_cache
 from . import account_move
 from . import apix_backend
 from . import transmit_method
@@ -22,11 +22,29 @@ class AccountMove(models.Model):
         if not self.company_id:
             raise ValidationError(_("This invoice has no company."))
 
-        backend = self.env["apix.backend"].search(
-            [
-                ("company_id", "=", self.company_id.id),
-            ],
-            limit=1,
+        ApixBackend = self.env["apix.backend"]
+        backend_id = ApixBackend._get_backend_id_for_company(self.company_id.id)
+
+        return ApixBackend.browse(backend_id)
+
+    def _group_by_apix_backend(self):
+        """
+        Group the invoices by their APIX backend.
+        Backends for all the companies are resolved with one query
+
+        :return: dict of apix.backend: account.move
+        """
+        ApixBackend = self.env["apix.backend"]
+
+        backends = ApixBackend.sudo().search(
+            [("company_id", "in", self.company_id.ids)]
         )
+        backend_ids = {backend.company_id.id: backend.id for backend in backends}
+
+        groups = dict()
+        for record in self:
+            backend = ApixBackend.browse(backend_ids.get(record.company_id.id))
+            groups.setdefault(backend, self.browse())
+            groups[backend] |= record
 
-        return backend
+        return groups
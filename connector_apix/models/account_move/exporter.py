@@ -1,36 +1,134 @@
-import base64
+import hashlib
 import logging
+import re
+import shutil
+import tempfile
 import zipfile
+from functools import partial
 from io import BytesIO
+from xml.sax.saxutils import escape
+
 from lxml import etree
+from requests import ConnectTimeout, HTTPError
+from requests import ConnectionError as RequestsConnectionError
+from urllib3.exceptions import MaxRetryError
 
 from odoo import _, fields, models
-from odoo.exceptions import ValidationError
+from odoo.exceptions import UserError, ValidationError
+
+from odoo.addons.queue_job.delay import chain, group
+from odoo.addons.queue_job.exception import RetryableJobError
+
+from ...tools.identity import get_identity_key
+from ...tools.response import get_credits
 
 _logger = logging.getLogger(__name__)
 
+# Payloads larger than this are spooled to a temporary file on disk
+PAYLOAD_SPOOL_SIZE = 8 * 1024 * 1024
+
+
+def get_payload_hash(payload):
+    # Returns the SHA-256 of a payload file object, leaving it at the start
+    payload_hash = hashlib.sha256()
+    payload.seek(0)
+    for chunk in iter(lambda: payload.read(64 * 1024), b""):
+        payload_hash.update(chunk)
+    payload.seek(0)
+
+    return payload_hash.hexdigest()
+
+
+def is_connect_error(error):
+    # Returns True if the connection to APIX could not be opened,
+    # so nothing was sent. Errors after connecting (e.g. read timeouts
+    # or an aborted connection) leave the upload state unknown
+    if isinstance(error, ConnectTimeout):
+        return True
+
+    reason = error.args[0] if error.args else None
+    return isinstance(error, RequestsConnectionError) and isinstance(
+        reason, MaxRetryError
+    )
+
+
+FINVOICE_CLOSING_TAG = b"</Finvoice>"
+FINVOICE_URL_TAGS = ("InvoiceUrlNameText", "InvoiceUrlText")
+XML_ENCODING_RE = re.compile(rb"^<\?xml[^>]*encoding=[\"']([A-Za-z0-9._-]+)[\"']")
+
 
 class AccountMove(models.Model):
     _inherit = "account.move"
 
     def action_einvoice_send(self):
+        errors = self._get_einvoice_errors()
+        if errors and len(self) == 1:
+            raise ValidationError(errors[self])
+
+        batches = dict()
+        send_jobs = []
+        send_records = self.browse()
         for record in self:
-            record.validate_einvoice()
+            if record in errors:
+                continue
 
             if len(self) > 1:
+                backend = record.get_apix_backend()
+                if backend.send_mode == "batch":
+                    # Collect invoices to be sent in batches
+                    batches.setdefault(backend, self.browse())
+                    batches[backend] |= record
+                    continue
+
                 # Add sending to queue
-                job_desc = _("APIX send invoice '%s'") % record.number
-                record.with_delay(description=job_desc).einvoice_send()
+                job_desc = _("APIX package invoice '%s'") % record.name
+                send_jobs.append(
+                    record.delayable(
+                        description=job_desc,
+                        identity_key=get_identity_key("apix-package", record.id),
+                    ).einvoice_send_package()
+                )
+                send_records |= record
             else:
                 # Send eInvoice now
                 record.einvoice_send()
 
-    def _get_finvoice_object(self):
-        finvoice_object = super()._get_finvoice_object()
+        if send_jobs:
+            # Render the PDFs in batches before the invoices are sent
+            job_desc = _("APIX render %s invoice PDFs") % len(send_records)
+            prerender = send_records.delayable(
+                description=job_desc,
+                identity_key=get_identity_key("apix-prerender", send_records.ids),
+            ).apix_prerender_pdfs()
+            chain(prerender, group(*send_jobs)).delay()
 
-        self.add_finvoice_apix_fields(finvoice_object)
+        for backend, records in batches.items():
+            batch_size = max(backend.send_batch_size, 1)
+            for index in range(0, len(records), batch_size):
+                batch = records[index : index + batch_size]
+                job_desc = _("APIX send %(count)s invoices for '%(backend)s'") % {
+                    "count": len(batch),
+                    "backend": backend.name,
+                }
+                batch.with_delay(
+                    description=job_desc,
+                    identity_key=get_identity_key("apix-send-batch", batch.ids),
+                ).einvoice_send_batch()
 
-        return finvoice_object
+        if errors:
+            # Report the invoices that were not sent
+            return {
+                "type": "ir.actions.client",
+                "tag": "display_notification",
+                "params": {
+                    "title": _("%s invoices could not be sent") % len(errors),
+                    "message": "\n".join(
+                        f"{move.name}: {msg}" for move, msg in errors.items()
+                    ),
+                    "type": "warning",
+                    "sticky": True,
+                },
+            }
 
     def _get_finvoice_message_sender_details(self):
         MessageSenderDetailsType = super()._get_finvoice_message_sender_details()
@@ -46,46 +144,114 @@ class AccountMove(models.Model):
 
         return MessageReceiverDetailsType
 
-    def add_finvoice_apix_fields(self, finvoice_attachment, attachments=False):
-        root = etree.fromstring(finvoice_attachment.raw)
+    def add_finvoice_apix_fields(
+        self,
+        finvoice_attachment,
+        attachments=False,
+        pdf_name="invoice.pdf",
+        attachments_name="attachments.zip",
+    ):
+        """
+        Add the APIX file references to the Finvoice XML.
+        The elements are spliced in before the closing Finvoice tag, so the
+        document is only parsed if it already has file references
+
+        :param finvoice_attachment: Finvoice ir.attachment or XML as bytes
+        :return: Finvoice XML as bytes
+        """
+        if isinstance(finvoice_attachment, bytes):
+            finvoice = finvoice_attachment
+        else:
+            finvoice = finvoice_attachment.raw
 
-        # Add PDF info after EPI details
         # The format is
         # <InvoiceUrlNameText>APIX_PDFFILE</ InvoiceUrlNameText>
         # <InvoiceUrlNameText>APIX_ATTACHMENT</ InvoiceUrlNameText>
         # <InvoiceUrlText>file://invoice.pdf</ InvoiceUrlText>
         # <InvoiceUrlText>attachments.zip</ InvoiceUrlText>
+        url_names = ["APIX_PDFFILE"]
+        urls = ["file://%s" % pdf_name]
+        if attachments:
+            url_names.append("APIX_ATTACHMENT")
+            urls.append("file://%s" % attachments_name)
 
-        url_name = etree.Element("InvoiceUrlNameText")
-        url_name.text = "APIX_PDFFILE"
-        root.append(url_name)
+        encoding = XML_ENCODING_RE.match(finvoice)
+        encoding = encoding.group(1).decode() if encoding else "utf-8"
 
-        if attachments:
-            url_name = etree.Element("InvoiceUrlNameText")
-            url_name.text = "APIX_ATTACHMENT"
+        apix_fields = "".join(
+            [
+                f"<{tag}>{escape(value)}</{tag}>"
+                for tag, values in zip(FINVOICE_URL_TAGS, (url_names, urls))
+                for value in values
+            ]
+        ).encode(encoding, "xmlcharrefreplace")
 
-            root.append(url_name)
+        if apix_fields + FINVOICE_CLOSING_TAG in finvoice:
+            # Already has exactly these references
+            return finvoice
 
-        url_text = etree.Element("InvoiceUrlText")
-        url_text.text = "file://invoice.pdf"
-        root.append(url_text)
+        index = finvoice.rfind(FINVOICE_CLOSING_TAG)
+        if index == -1 or b"<InvoiceUrl" in finvoice:
+            return self._replace_finvoice_apix_fields(finvoice, url_names, urls)
 
-        if attachments:
-            url_text = etree.Element("InvoiceUrlText")
-            url_text.text = "file://attachments.zip"
-            root.append(url_text)
+        return finvoice[:index] + apix_fields + finvoice[index:]
+
+    def _replace_finvoice_apix_fields(self, finvoice, url_names, urls):
+        """
+        Replace the file references of a Finvoice XML by parsing it
 
-        return etree.tostring(root)
+        :return: Finvoice XML as bytes
+        """
+        tree = etree.parse(BytesIO(finvoice))
+        root = tree.getroot()
+
+        for element in list(root):
+            if etree.QName(element).localname in FINVOICE_URL_TAGS:
+                root.remove(element)
+
+        for tag, values in zip(FINVOICE_URL_TAGS, (url_names, urls)):
+            for value in values:
+                element = etree.SubElement(root, tag)
+                element.text = value
+
+        return etree.tostring(
+            tree, xml_declaration=True, encoding=tree.docinfo.encoding or "utf-8"
+        )
 
     def get_apix_payload(self):
+        """
+        Get the APIX payload for this invoice
+
+        :return: a file object positioned at the start of the payload zip
+        """
+        self.ensure_one()
+
+        with self.get_apix_backend()._apix_measure("package") as stat:
+            payload = tempfile.SpooledTemporaryFile(max_size=PAYLOAD_SPOOL_SIZE)
+            # Write the payload
+            with zipfile.ZipFile(payload, "w") as payload_zip:
+                self._write_apix_payload(payload_zip, self._prepare_apix_payload())
+
+            stat["payload_size"] = payload.tell()
+            payload.seek(0)
+        _logger.debug(f"APIX payload for '{self.name}' generated")
+
+        return payload
+
+    def _prepare_apix_payload(self, unique_names=False):
+        """
+        Collect the contents of the APIX payload for this invoice
+
+        :param unique_names: name the PDF and the attachments after the
+            Finvoice file, so several invoices can share one payload
+        :return: dict with the file names, file contents and attachments
+        """
         self.ensure_one()
 
         _logger.debug(f"Generating APIX payload for '{self.name}'")
         # Generate PDF
         backend = self.get_apix_backend()
-        inv_report = backend.invoice_template_id
-        _logger.debug(f"Using report template '{inv_report.report_name}'")
-        inv_pdf = inv_report._render_qweb_pdf(inv_report.report_name, self.ids)
+        inv_pdf = self._get_apix_pdf(backend)
 
         # Get attachments
         attachments = self.env["ir.attachment"].search(
@@ -107,47 +273,199 @@ class AccountMove(models.Model):
         # Use the latest document
         finvoice_xml = finvoice_xml[0].sudo()
 
-        # Construct Finvoice XML data
-        attachment_names = ["invoice.pdf"]
-        attachment_names += attachments.mapped("name")
         finvoice_attachment = finvoice_xml.attachment_id
         finvoice_filename = finvoice_attachment.name
+
+        if unique_names:
+            file_prefix = finvoice_filename.rsplit(".", 1)[0]
+            pdf_name = f"{file_prefix}.pdf"
+            attachments_name = f"{file_prefix}_attachments.zip"
+        else:
+            pdf_name = "invoice.pdf"
+            attachments_name = "attachments.zip"
+
+        # Construct Finvoice XML data
         finvoice_datas = self.add_finvoice_apix_fields(
-            finvoice_attachment, len(attachments) > 0
+            finvoice_attachment,
+            len(attachments) > 0,
+            pdf_name=pdf_name,
+            attachments_name=attachments_name,
         )
 
-        # Add attachments to zip
-        attachments_zip_tmp = BytesIO()
-        attachments_payload = False
-        if attachments:
-            with zipfile.ZipFile(attachments_zip_tmp, "w") as attachments_zip:
-                # Iterate through all the attachments
-                for attachment in attachments:
-                    # Write the file to the cached zip
-                    file_name = attachment.name or "attachment"
+        size = len(finvoice_datas) + len(inv_pdf)
+        size += sum(attachments.mapped("file_size"))
+
+        return {
+            "finvoice_name": finvoice_filename,
+            "finvoice_data": finvoice_datas,
+            "pdf_name": pdf_name,
+            "pdf_data": inv_pdf,
+            "attachments_name": attachments_name,
+            "attachments": attachments,
+            "size": size,
+        }
 
-                    attachments_zip.writestr(file_name, attachment.raw)
+    def _get_apix_pdf_cache_fields(self):
+        # Fields that change the rendered invoice PDF
+        return [
+            "name",
+            "state",
+            "move_type",
+            "partner_id",
+            "partner_bank_id",
+            "currency_id",
+            "invoice_date",
+            "invoice_date_due",
+            "invoice_payment_term_id",
+            "invoice_origin",
+            "payment_reference",
+            "ref",
+            "narration",
+            "amount_untaxed",
+            "amount_tax",
+            "amount_total",
+            "amount_residual",
+            "payment_state",
+        ]
 
-            attachments_payload = attachments_zip_tmp.getvalue()
+    def _get_apix_pdf_cache_key(self, report):
+        """
+        Get a key for the rendered PDF of this invoice.
+        The key changes whenever the invoice, its lines, its partner or the
+        report template changes
 
-        payload_zip_tmp = BytesIO()
-        # Write the payload
-        with zipfile.ZipFile(payload_zip_tmp, "w") as payload_zip:
-            payload_data = finvoice_datas
-            payload_zip.writestr(finvoice_filename, payload_data)
+        :return: sha256 hex digest
+        """
+        self.ensure_one()
 
-            # Add printed PDF
-            payload_zip.writestr("invoice.pdf", inv_pdf[0])
+        values = [str(self.id), str(report.id), str(report.write_date)]
+        values += [str(self[field]) for field in self._get_apix_pdf_cache_fields()]
+        values.append(str(self.partner_id.write_date))
+        values += [
+            f"{line.id}:{line.write_date}"
+            for line in self.invoice_line_ids.sorted("id")
+        ]
 
-            # Add attachments
-            if attachments_payload:
-                _logger.debug("Adding attachments")
-                payload_zip.writestr("attachments.zip", attachments_payload)
+        return hashlib.sha256("|".join(values).encode("utf-8")).hexdigest()
 
-        payload = payload_zip_tmp.getvalue()
-        _logger.debug(f"APIX payload for '{self.name}' generated")
+    def apix_prerender_pdfs(self):
+        """
+        Render the invoice PDFs to the PDF cache.
+        Invoices are rendered several at a time, which is a lot faster than
+        rendering them one by one
+        """
+        pdf_cache = self.env["apix.pdf.cache"].sudo()
 
-        return payload
+        for backend, records in self._group_by_apix_backend().items():
+            if not backend.pdf_cache_max_mb:
+                # Nowhere to store the rendered PDFs
+                continue
+
+            inv_report = backend.invoice_template_id
+
+            keys = {
+                record.id: record._get_apix_pdf_cache_key(inv_report)
+                for record in records
+            }
+            cached_keys = set(
+                pdf_cache.search([("key", "in", list(keys.values()))]).mapped("key")
+            )
+            records = records.filtered(lambda r: keys[r.id] not in cached_keys)
+
+            batch_size = max(backend.render_batch_size, 1)
+            for index in range(0, len(records), batch_size):
+                batch = records[index : index + batch_size]
+                _logger.debug(f"Rendering {len(batch)} invoice PDFs")
+
+                try:
+                    with backend._apix_measure("render"):
+                        streams = inv_report._render_qweb_pdf_prepare_streams(
+                            inv_report.report_name, {}, res_ids=batch.ids
+                        )
+                except Exception as error:
+                    # The invoices will be rendered one by one when sending
+                    _logger.warning(f"Could not render invoice PDFs: {error}")
+                    continue
+
+                for record in batch:
+                    stream = streams.get(record.id, {}).get("stream")
+                    if stream:
+                        pdf_cache._set_pdf(
+                            keys[record.id], backend, record, stream.getvalue()
+                        )
+                        stream.close()
+
+    def _get_apix_pdf(self, backend):
+        """
+        Get the invoice PDF rendered with the backend invoice template.
+        A cached PDF is used, if the invoice hasn't changed
+
+        :return: PDF as bytes
+        """
+        self.ensure_one()
+
+        inv_report = backend.invoice_template_id
+        pdf_cache = self.env["apix.pdf.cache"].sudo()
+
+        key = self._get_apix_pdf_cache_key(inv_report)
+        if backend.pdf_cache_max_mb:
+            inv_pdf = pdf_cache._get_pdf(key)
+            if inv_pdf:
+                _logger.debug(f"Using cached PDF for '{self.name}'")
+                return inv_pdf
+
+        _logger.debug(f"Using report template '{inv_report.report_name}'")
+        with backend._apix_measure("render") as stat:
+            inv_pdf = inv_report._render_qweb_pdf(inv_report.report_name, self.ids)[0]
+            stat["payload_size"] = len(inv_pdf)
+
+        if backend.pdf_cache_max_mb:
+            pdf_cache._set_pdf(key, backend, self, inv_pdf)
+
+        return inv_pdf
+
+    def _write_apix_payload(self, payload_zip, prepared):
+        """
+        Write the prepared payload contents to a zip file.
+        Attachments are streamed from the filestore to a nested zip file
+
+        :param payload_zip: an open ZipFile
+        :param prepared: dict, as returned by _prepare_apix_payload
+        """
+        payload_zip.writestr(prepared["finvoice_name"], prepared["finvoice_data"])
+
+        # Add printed PDF
+        payload_zip.writestr(prepared["pdf_name"], prepared["pdf_data"])
+
+        attachments = prepared["attachments"]
+        if not attachments:
+            return
+
+        # Add attachments to zip
+        _logger.debug("Adding attachments")
+        with tempfile.SpooledTemporaryFile(
+            max_size=PAYLOAD_SPOOL_SIZE
+        ) as attachments_tmp:
+            with zipfile.ZipFile(attachments_tmp, "w") as attachments_zip:
+                # Iterate through all the attachments
+                for attachment in attachments.sudo():
+                    # Write the file to the cached zip
+                    file_name = attachment.name or "attachment"
+
+                    if attachment.store_fname:
+                        file_path = attachment._full_path(attachment.store_fname)
+                        with open(file_path, "rb") as source, attachments_zip.open(
+                            file_name, "w", force_zip64=True
+                        ) as target:
+                            shutil.copyfileobj(source, target)
+                    else:
+                        attachments_zip.writestr(file_name, attachment.raw)
+
+            attachments_tmp.seek(0)
+            with payload_zip.open(
+                prepared["attachments_name"], "w", force_zip64=True
+            ) as target:
+                shutil.copyfileobj(attachments_tmp, target)
 
     def einvoice_send(self):
         for record in self:
@@ -163,60 +481,510 @@ class AccountMove(models.Model):
 
             _logger.debug(f"Using backend {backend.name}")
 
+            outbox = record._get_apix_accepted_outbox()
+            if outbox:
+                # Already uploaded by an earlier, failed attempt
+                record._einvoice_record_sent(outbox._get_upload_results())
+                continue
+
             payload = record.get_apix_payload()
 
             if backend.debug:
                 self.env["ir.attachment"].create(
                     {
                         "name": f"apix_payload_{record.name}.zip",
-                        "raw": payload,
+                        "raw": payload.read(),
                         "mimetype": "application/zip",
                     }
                 )
+                payload.seek(0)
             try:
-                response = backend.SendInvoiceZIP(payload)
-            except ValidationError as error:
-                raise error
+                results = record._einvoice_upload(backend, payload)
+            finally:
+                payload.close()
+
+            record._einvoice_record_sent(results)
+
+    def _get_apix_accepted_outbox(self):
+        """
+        Get the outbox entry of an upload accepted by APIX, but not yet
+        recorded as sent.
+
+        Raises an error if an earlier upload was interrupted, as APIX may
+        have received the invoice
+
+        :return: apix.outbox
+        """
+        self.ensure_one()
+
+        outbox = (
+            self.env["apix.outbox"]
+            .sudo()
+            .search(
+                [
+                    ("move_id", "=", self.id),
+                    ("state", "in", ["uploading", "accepted"]),
+                ],
+                limit=1,
+            )
+        )
+
+        if outbox.state == "uploading":
+            raise UserError(
+                _(
+                    "An earlier upload of '%s' was interrupted. "
+                    "Check the invoice in APIX and retry the APIX outbox entry "
+                    "before sending again."
+                )
+                % self.name
+            )
+
+        return outbox
 
-            _logger.debug(_(f"Response for '{record.name}': {response}"))
+    def _einvoice_upload(self, backend, payload, outboxes=False):
+        """
+        Upload a payload containing these invoices.
 
-            record.date_einvoice_sent = fields.Date.today()
-            record.is_move_sent = True
+        The upload state and the APIX response are committed right away
+        to the outbox, so a failing transaction or a retried job never
+        uploads the same invoices twice.
 
-            apix_batch_id = response.find(".//Value[@type='BatchID']")
-            if apix_batch_id is not None:
-                apix_batch_id = apix_batch_id.text
+        Raises a ValidationError if APIX rejects the upload. If APIX accepts
+        only a part of a batch, the invoices that can't be matched to
+        the accepted documents are left uploading
 
-            apix_accepted_document_id = response.find(
-                ".//Value[@type='AcceptedDocumentID']"
+        :param backend: apix.backend
+        :param payload: zip file as a file object
+        :param outboxes: packaged outbox entries. Created if not given
+        :return: list of dicts of the upload results, one for each accepted
+            invoice in the same order
+        """
+        payload_hash = get_payload_hash(payload)
+
+        if outboxes:
+            packaged = True
+            outboxes._write_committed(
+                {
+                    outbox.id: {"state": "uploading", "payload_hash": payload_hash}
+                    for outbox in outboxes
+                }
+            )
+        else:
+            packaged = False
+            outboxes = (
+                self.env["apix.outbox"]
+                .sudo()
+                ._create_committed(
+                    [
+                        dict(
+                            move_id=record.id,
+                            backend_id=backend.id,
+                            state="uploading",
+                            payload_hash=payload_hash,
+                        )
+                        for record in self
+                    ]
+                )
+            )
+
+        try:
+            response = backend.SendInvoiceZIP(payload)
+        except (ValidationError, HTTPError, RequestsConnectionError) as error:
+            if isinstance(error, RequestsConnectionError) and not is_connect_error(
+                error
+            ):
+                raise
+
+            # APIX has rejected the upload, or was not reached at all.
+            # Other errors leave the upload state unknown
+            outboxes._write_committed(
+                {
+                    outbox.id: {"state": "failed", "error": str(error)}
+                    for outbox in outboxes
+                }
+            )
+            raise
+        except RetryableJobError as error:
+            # APIX is not available and nothing was sent.
+            # Packaged entries are uploaded again when the job is retried
+            outboxes._write_committed(
+                {
+                    outbox.id: (
+                        {"state": "packaged"}
+                        if packaged
+                        else {"state": "failed", "error": str(error)}
+                    )
+                    for outbox in outboxes
+                }
             )
+            raise
 
-            if apix_accepted_document_id is not None:
-                apix_accepted_document_id = apix_accepted_document_id.text
+        # Cost is reported for the whole upload
+        apix_cost_in_credits = get_credits(response) / len(outboxes)
 
-            apix_cost_in_credits = response.find(".//Value[@type='CostInCredits']")
+        apix_batch_id = response.find(".//Value[@type='BatchID']")
+        if apix_batch_id is not None:
+            apix_batch_id = apix_batch_id.text
 
-            if apix_cost_in_credits is not None:
-                apix_cost_in_credits = apix_cost_in_credits.text
+        accepted_document_ids = [
+            value.text
+            for value in response.findall(".//Value[@type='AcceptedDocumentID']")
+        ]
 
-            response.find(".//Value[@type='BatchID']").text
+        response_xml = etree.tostring(response, encoding="unicode")
+        now = fields.Datetime.now()
+
+        if len(outboxes) == 1:
+            accepted = {
+                self.id: accepted_document_ids[0] if accepted_document_ids else False
+            }
+        elif len(accepted_document_ids) == len(outboxes):
+            # Everything was accepted, in the upload order
+            accepted = dict(zip(self.ids, accepted_document_ids))
+        else:
+            accepted = self._match_apix_accepted_documents(response)
+            _logger.warning(
+                f"APIX batch {apix_batch_id}: {len(accepted_document_ids)} "
+                f"of {len(outboxes)} documents accepted, "
+                f"{len(accepted)} matched to invoices"
+            )
 
-            binding_values = dict(
+        results = [
+            dict(
+                outbox_id=outbox.id,
+                move_id=record.id,
                 backend_id=backend.id,
-                odoo_id=record.id,
+                response=response_xml,
                 apix_batch_id=apix_batch_id,
-                apix_accepted_document_id=apix_accepted_document_id,
+                apix_accepted_document_id=accepted[record.id],
                 apix_cost_in_credits=apix_cost_in_credits,
             )
+            for record, outbox in zip(self, outboxes)
+            if record.id in accepted
+        ]
+        values_by_id = {
+            result["outbox_id"]: dict(
+                state="accepted",
+                date_uploaded=now,
+                response=result["response"],
+                apix_batch_id=result["apix_batch_id"],
+                apix_accepted_document_id=result["apix_accepted_document_id"],
+                apix_cost_in_credits=result["apix_cost_in_credits"],
+            )
+            for result in results
+        }
+
+        # APIX may or may not have accepted the rest. They are left uploading,
+        # so they are checked by hand instead of being sent twice
+        unknown = self.filtered(lambda record: record.id not in accepted)
+        for outbox in outboxes:
+            if outbox.id not in values_by_id:
+                values_by_id[outbox.id] = dict(
+                    response=response_xml,
+                    apix_batch_id=apix_batch_id,
+                    error=_(
+                        "APIX accepted only a part of the batch, and this "
+                        "invoice could not be identified in the response"
+                    ),
+                )
+        outboxes._write_committed(values_by_id)
+
+        for record in unknown:
+            record.message_post(
+                body=_(
+                    f"APIX accepted only a part of batch '{apix_batch_id}'. "
+                    "Check this invoice in APIX and retry its APIX outbox "
+                    "entry if it was not received"
+                )
+            )
+
+        return results
+
+    def _match_apix_accepted_documents(self, response):
+        """
+        Match the accepted documents of a partially accepted batch to these
+        invoices. A document is matched, when its response group has
+        the invoice number
+
+        :param response: APIX response
+        :return: dict of invoice id: APIX document id
+        """
+        ids_by_name = {record.name: record.id for record in self}
+
+        accepted = dict()
+        for response_group in response.iter("Group"):
+            document_id = response_group.findtext("Value[@type='AcceptedDocumentID']")
+            if not document_id:
+                continue
+
+            for value in response_group.iter("Value"):
+                move_id = ids_by_name.get((value.text or "").strip())
+                if move_id and move_id not in accepted:
+                    accepted[move_id] = document_id
+                    break
+
+        return accepted
+
+    def _einvoice_record_sent(self, results):
+        """
+        Mark the invoices as sent and store the APIX results to bindings
+
+        :param results: list of upload results, as returned by
+            _einvoice_upload or apix.outbox._get_upload_results
+        """
+        if not results:
+            return
+
+        self.browse([result["move_id"] for result in results]).write(
+            {
+                "date_einvoice_sent": fields.Date.today(),
+                "is_move_sent": True,
+            }
+        )
+
+        binding_values = [
+            dict(
+                backend_id=result["backend_id"],
+                odoo_id=result["move_id"],
+                apix_batch_id=result["apix_batch_id"],
+                apix_accepted_document_id=result["apix_accepted_document_id"],
+                apix_cost_in_credits=result["apix_cost_in_credits"],
+            )
+            for result in results
+        ]
+
+        # Create the bindings
+        self.sudo().env["apix.account.invoice"].create(binding_values)
 
-            # Create a binding
-            self.sudo().env["apix.account.invoice"].create(binding_values)
+        # The outbox entries may have been created after this transaction
+        # started, so they are not visible here. They are marked recorded
+        # only once the invoices have been committed as sent
+        self.env.cr.postcommit.add(
+            partial(
+                self.env["apix.outbox"].sudo()._write_committed,
+                {result["outbox_id"]: {"state": "recorded"} for result in results},
+            )
+        )
 
+        for result in results:
+            record = self.browse(result["move_id"])
+            transmit_method = record.transmit_method_id.name
+            _logger.debug(_(f"Response for '{record.name}': {result['response']}"))
             record.message_post(body=_(f"Invoice sent as '{transmit_method}'"))
             _logger.debug(_(f"Sent '{record.name}' as '{transmit_method}'"))
 
+    # region Send pipeline
+    # Sending multiple invoices is split into queued stages:
+    # render (apix_prerender_pdfs) -> package -> upload -> record.
+    # Each stage runs in its own channel and transaction
+
+    def einvoice_send_package(self):
+        """
+        Pipeline stage: build the APIX payload and queue the upload
+        """
+        for record in self:
+            backend = record.get_apix_backend()
+
+            if not backend:
+                raise Exception(_("No backend found"))
+
+            outbox = record._get_apix_accepted_outbox()
+            if not outbox:
+                outbox = (
+                    self.env["apix.outbox"]
+                    .sudo()
+                    .create({"move_id": record.id, "backend_id": backend.id})
+                )
+
+                # The payload is kept on disk until it is uploaded
+                with record.get_apix_payload() as payload:
+                    outbox._store_payload(payload)
+
+            job_desc = _("APIX upload invoice '%s'") % record.name
+            record.with_delay(
+                description=job_desc,
+                identity_key=get_identity_key("apix-upload", outbox.id),
+            ).einvoice_send_upload(outbox.id)
+
+    def einvoice_send_upload(self, outbox_id):
+        """
+        Pipeline stage: upload a packaged payload and queue recording
+        the result
+
+        :param outbox_id: apix.outbox id of the packaged payload
+        """
+        self.ensure_one()
+
+        outbox = self.env["apix.outbox"].sudo().browse(outbox_id)
+        if outbox.state == "packaged":
+            backend = outbox.backend_id
+
+            # The payload is kept until the upload has been accepted,
+            # so a failed upload can be uploaded again
+            with open(outbox._get_payload_path(), "rb") as payload:
+                self._einvoice_upload(backend, payload, outbox)
+
+            if not backend.debug:
+                # Keep payloads only for debugging
+                outbox._remove_payload()
+        elif outbox.state == "uploading":
+            # Raises an error about the interrupted upload
+            self._get_apix_accepted_outbox()
+        elif outbox.state == "failed":
+            raise UserError(
+                _(
+                    "Uploading '%(name)s' to APIX has failed: %(error)s\n"
+                    "Upload the APIX outbox entry again, or send the invoice "
+                    "again."
+                )
+                % {"name": self.name, "error": outbox.error}
+            )
+
+        job_desc = _("APIX record sent invoice '%s'") % self.name
+        self.with_delay(
+            description=job_desc,
+            identity_key=get_identity_key("apix-record", outbox.id),
+        ).einvoice_send_record(outbox.id)
+
+    def einvoice_send_record(self, outbox_id):
+        """
+        Pipeline stage: mark the invoice as sent
+
+        :param outbox_id: apix.outbox id of the accepted upload
+        """
+        self.ensure_one()
+
+        outbox = self.env["apix.outbox"].sudo().browse(outbox_id)
+        if outbox.state != "accepted":
+            return _("Nothing to record")
+
+        self._einvoice_record_sent(outbox._get_upload_results())
+
+    # endregion
+
+    def einvoice_send_batch(self):
+        """
+        Send the invoices in as few uploads as possible.
+        Invoices are packed in batches bounded by the batch size settings
+        of the backend
+        """
+        self.apix_prerender_pdfs()
+
+        for backend, records in self._group_by_apix_backend().items():
+            if not backend:
+                raise Exception(_("No backend found"))
+
+            max_count = max(backend.send_batch_size, 1)
+            max_size = backend.send_batch_max_mb * 1024 * 1024
+
+            batch = []
+            batch_size = 0
+            for record in records:
+                try:
+                    outbox = record._get_apix_accepted_outbox()
+                except UserError as error:
+                    # An interrupted upload is checked by hand.
+                    # The other invoices are still sent
+                    _logger.warning(f"Skipping '{record.name}': {error}")
+                    continue
+
+                if outbox:
+                    # Already uploaded by an earlier, failed attempt
+                    record._einvoice_record_sent(outbox._get_upload_results())
+                    continue
+
+                prepared = record._prepare_apix_payload(unique_names=True)
+                size = prepared["size"]
+
+                if batch and (len(batch) >= max_count or batch_size + size > max_size):
+                    self._einvoice_send_apix_batch(backend, batch)
+                    batch = []
+                    batch_size = 0
+
+                batch.append((record, prepared))
+                batch_size += size
+
+            if batch:
+                self._einvoice_send_apix_batch(backend, batch)
+
+    def _einvoice_send_apix_batch(self, backend, batch):
+        """
+        Upload a batch of invoices as one payload
+
+        :param backend: apix.backend
+        :param batch: list of (invoice, prepared payload contents)
+        """
+        records = self.browse([record.id for record, _prepared in batch])
+        _logger.debug(f"Sending {len(records)} invoices as a batch")
+
+        payload = tempfile.SpooledTemporaryFile(max_size=PAYLOAD_SPOOL_SIZE)
+        with zipfile.ZipFile(payload, "w") as payload_zip:
+            for record, prepared in batch:
+                record._write_apix_payload(payload_zip, prepared)
+        payload.seek(0)
+
+        if backend.debug:
+            self.env["ir.attachment"].create(
+                {
+                    "name": "apix_payload_batch.zip",
+                    "raw": payload.read(),
+                    "mimetype": "application/zip",
+                }
+            )
+            payload.seek(0)
+
+        try:
+            results = records._einvoice_upload(backend, payload)
+        except ValidationError as error:
+            # The whole batch was rejected.
+            # Send the invoices one by one to get the errors per invoice
+            _logger.warning(f"APIX batch rejected, sending one by one: {error}")
+            for record in records:
+                job_desc = _("APIX send invoice '%s'") % record.name
+                record.with_delay(
+                    description=job_desc,
+                    identity_key=get_identity_key("apix-send", record.id),
+                ).einvoice_send()
+            return
+        finally:
+            payload.close()
+
+        records._einvoice_record_sent(results)
+
     def validate_einvoice(self):
-        result = False
+        errors = self._get_einvoice_errors()
+
+        if errors:
+            if len(self) == 1:
+                raise ValidationError(errors[self])
+
+            raise ValidationError(
+                "\n".join(f"{move.name}: {msg}" for move, msg in errors.items())
+            )
+
+        return True
+
+    def _get_einvoice_errors(self):
+        """
+        Validate the invoices for sending.
+        Data needed for validation is prefetched for all the invoices at once
+
+        :return: dict of invoice: error message, for the invalid invoices
+        """
+        self.fetch(["state", "partner_id", "partner_bank_id", "transmit_method_id"])
+        self.transmit_method_id.fetch(["code"])
+        self.partner_id.fetch(["name", "vat", "edicode", "einvoice_operator_id"])
+
+        errors = dict()
+        for record in self:
+            msg = record._get_einvoice_error()
+            if msg:
+                errors[record] = msg
+
+        return errors
+
+    def _get_einvoice_error(self):
+        self.ensure_one()
         msg = False
 
         # Invoice can be sent only when it is open or paid
@@ -262,10 +1030,4 @@ class AccountMove(models.Model):
         elif not self.partner_bank_id:
             msg = _("Please define a bank account for the invoice.")
 
-        else:
-            result = True
-
-        if msg:
-            raise ValidationError(msg)
-
-        return result
+        return msg
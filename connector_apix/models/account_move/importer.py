@@ -45,3 +45,33 @@ class ApixAccountInvoice(models.Model):
         finvoice.unlink()
 
         return res_id
+
+
+class AccountMove(models.Model):
+    _inherit = "account.move"
+
+    def _lookup_partner_by_vat_or_business_code(self, vat, business_code, company_id):
+        # Use the supplier already found from the partner index of
+        # the APIX import batch
+        partner_id = self.env.context.get("apix_partner_id")
+        if partner_id:
+            return self.env["res.partner"].browse(partner_id)
+
+        return super()._lookup_partner_by_vat_or_business_code(
+            vat, business_code, company_id
+        )
+
+
+class ProductProduct(models.Model):
+    _inherit = "product.product"
+
+    def _retrieve_product(self, name=None, default_code=None, barcode=None, **kwargs):
+        # Use the products already found by default code for
+        # the APIX import batch
+        product_id = self.env.context.get("apix_product_ids", {}).get(default_code)
+        if product_id:
+            return self.browse(product_id)
+
+        return super()._retrieve_product(
+            name=name, default_code=default_code, barcode=barcode, **kwargs
+        )
@@ -1,20 +1,76 @@
-import base64
-import datetime
+import filecmp
 import hashlib
 import logging
-from collections import OrderedDict
-from io import BytesIO
+import os
+import random
+import shutil
+import tempfile
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import timedelta
 from mimetypes import MimeTypes
+from urllib.parse import urlsplit
 from zipfile import ZipFile
 
-import requests
 from lxml import etree as ET
-
-from odoo import _, fields, models
-from odoo.exceptions import ValidationError
+from psycopg2.errors import LockNotAvailable
+from requests import RequestException
+
+from odoo import _, api, fields, models, tools
+from odoo.exceptions import UserError, ValidationError
+from odoo.osv import expression
+
+from odoo.addons.queue_job.exception import RetryableJobError
+
+from ..tools.identity import get_identity_key
+from ..tools.partner_index import (
+    PartnerIndex,
+    get_business_keys,
+    get_finvoice_partner_keys,
+    normalize,
+)
+from ..tools.response import get_credits, iter_groups
+from ..tools.session import (
+    UploadBody,
+    close_sessions,
+    fetch_content,
+    get_session,
+    get_session_stats,
+    read_and_discard,
+)
+from ..tools.signer import ApixSigner
 
 _logger = logging.getLogger(__name__)
 
+MIMETYPES = MimeTypes()
+
+# Scheduled fetches are spread randomly over the fetch cron interval
+FETCH_CRON_XMLID = "connector_apix.ir_cron_apix_purchase_invoice_import"
+FETCH_SPREAD_DEFAULT = 15 * 60
+INTERVAL_SECONDS = {
+    "minutes": 60,
+    "hours": 60 * 60,
+    "days": 24 * 60 * 60,
+    "weeks": 7 * 24 * 60 * 60,
+    "months": 30 * 24 * 60 * 60,
+}
+
+# Value types of the APIX document metadata
+METADATA_SIZE_KEYS = ("FileSize", "DocumentSize", "Size")
+METADATA_BUSINESS_ID_KEYS = ("SenderYtunnus", "SenderBusinessID", "SenderID")
+
+# Attachments of a downloaded invoice are created in batches of this size,
+# when they are stored in the database
+ATTACHMENT_BATCH_SIZE = 16 * 1024 * 1024
+
+# Zip members are copied to the filestore in chunks of this size
+ATTACHMENT_CHUNK_SIZE = 1024 * 1024
+
+# Documents left unfinished this long, e.g. by a cancelled job, are queued again
+STALE_DOCUMENT_HOURS = 2
+
 
 class ApixBackend(models.Model):
     # region Private attributes
@@ -78,11 +134,27 @@ class ApixBackend(models.Model):
     # Apix environment
     environment = fields.Selection(
         string="Environment",
-        selection=[("test", "Test"), ("production", "Production")],
+        selection=[
+            ("test", "Test"),
+            ("production", "Production"),
+            ("custom", "Custom"),
+        ],
         default="test",
         required=True,
     )
 
+    custom_api_url = fields.Char(
+        string="API URL",
+        help="API URL for a custom environment, e.g. a local APIX stand-in "
+        "server for benchmarking",
+    )
+
+    custom_terminal_url = fields.Char(
+        string="Terminal URL",
+        help="Terminal URL for a custom environment. Used for listing and "
+        "downloading invoices",
+    )
+
     debug = fields.Boolean(
         string="Debug mode",
         help="Save debugging data, like APIX payload as an attachment",
@@ -179,6 +251,218 @@ class ApixBackend(models.Model):
         required=True,
         default=lambda s: s.env.ref("account.account_invoices"),
     )
+
+    # Sending settings
+    send_mode = fields.Selection(
+        string="Sending mode",
+        selection=[
+            ("single", "One invoice per upload"),
+            ("batch", "Batch upload"),
+        ],
+        default="single",
+        required=True,
+        help="When sending multiple invoices, batch upload packs several "
+        "invoices into one upload",
+    )
+
+    send_batch_size = fields.Integer(
+        string="Max invoices per batch",
+        default=100,
+        required=True,
+    )
+
+    send_batch_max_mb = fields.Float(
+        string="Max batch size (MB)",
+        default=10,
+        required=True,
+    )
+
+    pdf_cache_max_mb = fields.Float(
+        string="PDF cache size (MB)",
+        help="Rendered invoice PDFs are cached and reused when the invoice "
+        "is sent again without changes. Set to 0 to disable the cache",
+        default=100,
+    )
+
+    render_batch_size = fields.Integer(
+        string="Render batch size",
+        help="How many invoice PDFs are rendered at once when sending "
+        "multiple invoices",
+        default=20,
+        required=True,
+    )
+
+    refetch_since = fields.Date(
+        string="Refetch since",
+        help="Refetch only documents first seen on or after this date. "
+        "Leave empty to refetch everything",
+    )
+
+    fetch_interval_min = fields.Integer(
+        string="Minimum fetch interval (minutes)",
+        help="Inbox is fetched at most this often, when new invoices arrive",
+        default=15,
+    )
+
+    fetch_interval_max = fields.Integer(
+        string="Maximum fetch interval (minutes)",
+        help="Inbox is fetched at least this often, when no new invoices arrive",
+        default=240,
+    )
+
+    fetch_interval = fields.Integer(
+        string="Fetch interval (minutes)",
+        help="Current fetch interval. Halved when new invoices are found and "
+        "doubled when not, between the minimum and the maximum",
+        default=60,
+        readonly=True,
+    )
+
+    next_fetch = fields.Datetime(
+        string="Next fetch",
+        help="When the inbox is fetched next time. Empty means at the next "
+        "scheduled run",
+        readonly=True,
+    )
+
+    last_fetch = fields.Datetime(
+        string="Last fetch",
+        help="When the inbox was last listed",
+        readonly=True,
+    )
+
+    fetch_priority = fields.Integer(
+        string="Fetch job priority",
+        help="Queue job priority of the fetch jobs. Lower runs first",
+        default=10,
+    )
+
+    fetch_channel = fields.Char(
+        string="Fetch job channel",
+        help="Queue job channel of the fetch jobs, "
+        "e.g. root.apix.customer to isolate a backend",
+        default="root.apix",
+    )
+
+    download_concurrency = fields.Integer(
+        string="Concurrent downloads",
+        help="How many invoices are downloaded at the same time by one job. "
+        "Keep this at most the connection pool size",
+        default=4,
+        required=True,
+    )
+
+    download_batch_size = fields.Integer(
+        string="Download batch size",
+        help="How many invoices are downloaded and imported in one job",
+        default=20,
+        required=True,
+    )
+
+    acknowledge_received = fields.Boolean(
+        string="Mark invoices received",
+        help="Mark invoices as received in APIX after they have been "
+        "imported, so they are not listed as new again",
+        default=True,
+    )
+
+    use_metadata = fields.Boolean(
+        string="Check metadata before download",
+        help="Fetch the metadata of new documents first. Invoices that "
+        "already exist as vendor bills are not downloaded, and small "
+        "documents are downloaded first",
+        default=False,
+    )
+
+    # Connection settings
+    http_pool_size = fields.Integer(
+        string="Connection pool size",
+        help="Maximum number of kept-alive connections per APIX host and worker",
+        default=4,
+        required=True,
+    )
+
+    http_connect_timeout = fields.Float(
+        string="Connect timeout",
+        help="Seconds to wait for a connection to APIX",
+        default=10,
+        required=True,
+    )
+
+    http_read_timeout = fields.Float(
+        string="Read timeout",
+        help="Seconds to wait for a response from APIX",
+        default=120,
+        required=True,
+    )
+
+    http_max_retries = fields.Integer(
+        string="Retries",
+        help="How many times a failed connection or a server error is retried. "
+        "Invoice uploads are retried only on connection errors",
+        default=3,
+        required=True,
+    )
+
+    http_retry_backoff = fields.Float(
+        string="Retry backoff",
+        help="Backoff factor in seconds between the retries",
+        default=0.5,
+        required=True,
+    )
+
+    # Rate limiting and circuit breaker
+    rate_limit = fields.Float(
+        string="Rate limit",
+        help="Maximum requests per second to each APIX host, shared by all "
+        "workers. The rate is lowered automatically when APIX is overloaded. "
+        "Set to 0 to disable rate limiting",
+        default=5,
+    )
+
+    rate_limit_burst = fields.Integer(
+        string="Rate limit burst",
+        help="How many requests can be sent at once before the rate limit applies",
+        default=10,
+    )
+
+    breaker_threshold = fields.Integer(
+        string="Failures before pausing",
+        help="APIX jobs are paused after this many consecutive failed "
+        "requests to a host",
+        default=5,
+    )
+
+    breaker_cooldown = fields.Integer(
+        string="Pause (seconds)",
+        help="How long APIX jobs are paused before APIX is probed again",
+        default=60,
+    )
+
+    endpoint_ids = fields.One2many(
+        comodel_name="apix.endpoint",
+        inverse_name="backend_id",
+        string="Endpoints",
+        readonly=True,
+    )
+
+    http_pool_stats = fields.Text(
+        string="Connection pool statistics",
+        compute="_compute_http_pool_stats",
+        help="Connection statistics for the current worker",
+    )
+
+    call_stats = fields.Text(
+        string="Call statistics",
+        compute="_compute_call_stats",
+        help="APIX calls and processing stages in the last 24 hours",
+    )
+
+    call_stats_days = fields.Integer(
+        string="Keep call statistics (days)",
+        help="How long the statistics of single calls are kept",
+        default=7,
+    )
     # endregion
 
     def _compute_business_id(self):
@@ -188,6 +472,78 @@ class ApixBackend(models.Model):
 
             record.business_id = prefix + business_id
 
+    def _compute_http_pool_stats(self):
+        for record in self:
+            stats = get_session_stats(self.env.cr.dbname, record.id)
+
+            lines = []
+            for host, values in stats.items():
+                lines.append(
+                    _(
+                        "%(host)s: %(requests)s requests, %(errors)s errors, "
+                        "%(connections)s connections opened, "
+                        "%(reused)s requests on reused connections",
+                        host=host,
+                        **values,
+                    )
+                )
+
+            record.http_pool_stats = "\n".join(lines) or _("No connections")
+
+    def _compute_call_stats(self):
+        for record in self:
+            aggregates = self.env["apix.call"].sudo()._get_aggregates(record)
+
+            lines = []
+            for operation, values in sorted(aggregates.items()):
+                lines.append(
+                    _(
+                        "%(operation)s: %(count)s calls, %(errors)s errors, "
+                        "%(duration_avg).0f ms avg, %(duration_max).0f ms max, "
+                        "%(payload_size)s bytes, %(credits)s credits",
+                        operation=operation,
+                        **values,
+                    )
+                )
+
+            record.call_stats = "\n".join(lines) or _("No calls")
+
+    # region CRUD methods
+    @api.model_create_multi
+    def create(self, vals_list):
+        res = super().create(vals_list)
+        self.env.registry.clear_cache()
+
+        return res
+
+    def write(self, values):
+        res = super().write(values)
+
+        if "company_id" in values or "password" in values:
+            self.env.registry.clear_cache()
+
+        if any(field.startswith("http_") for field in values):
+            for record in self:
+                close_sessions(self.env.cr.dbname, record.id)
+
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.env.registry.clear_cache()
+
+        return res
+
+    @api.model
+    @tools.ormcache("company_id")
+    def _get_backend_id_for_company(self, company_id):
+        # Returns the id of the backend of a company (cached)
+        backend = self.sudo().search([("company_id", "=", company_id)], limit=1)
+
+        return backend.id
+
+    # endregion
+
     # region Action methods
     def action_authenticate(self):
         # A helper method for testing the authentication
@@ -207,107 +563,850 @@ class ApixBackend(models.Model):
             record.state = "unconfirmed"
 
     def action_cron_einvoice_fetch(self):
-        for backend in self.search([]):
-            backend.action_einvoice_fetch()
+        """
+        Queue fetches for the confirmed backends that are due.
+        The fetches are spread over the cron interval, so all the backends
+        don't hit APIX at the same time
+        """
+        now = fields.Datetime.now()
+        backends = self.search(
+            [
+                ("state", "=", "confirmed"),
+                "|",
+                ("next_fetch", "=", False),
+                ("next_fetch", "<=", now),
+            ]
+        )
+
+        spread = self._get_fetch_spread()
+        for backend in backends:
+            eta = now + timedelta(seconds=random.uniform(0, spread))
+            backend._enqueue_fetch(
+                eta=eta, identity_key=get_identity_key("apix-fetch", backend.id)
+            )
+            # Don't queue again before the fetch has run
+            backend.next_fetch = eta + timedelta(minutes=backend.fetch_interval)
+
+    @api.model
+    def _get_fetch_spread(self):
+        # Seconds between the runs of the fetch cron
+        cron = self.env.ref(FETCH_CRON_XMLID, raise_if_not_found=False)
+        if not cron:
+            return FETCH_SPREAD_DEFAULT
+
+        cron = cron.sudo()
+        seconds = cron.interval_number * INTERVAL_SECONDS.get(cron.interval_type, 0)
+        return seconds or FETCH_SPREAD_DEFAULT
 
     def action_einvoice_fetch(self):
         for record in self:
-            # Add fetching to queue
-            job_desc = _("APIX fetch invoices for '%s'") % record.name
-            record.with_delay(description=job_desc).list_invoices(refetch=False)
+            # Add fetching to queue. A manual fetch runs right away,
+            # even if the scheduled fetch is still waiting
+            record._enqueue_fetch(
+                identity_key=get_identity_key("apix-fetch-manual", record.id)
+            )
+
+    def _enqueue_fetch(self, eta=None, identity_key=None):
+        # Queues a fetch with the backend priority and channel
+        self.ensure_one()
+
+        job_desc = _("APIX fetch invoices for '%s'") % self.name
+        self.with_delay(
+            description=job_desc,
+            priority=self.fetch_priority,
+            channel=self.fetch_channel or None,
+            eta=eta,
+            identity_key=identity_key,
+        ).list_invoices(refetch=False)
+
+    def _lock_fetch(self):
+        """
+        Make sure only one fetch of the backend lists the inbox at a time.
+        The backend row stays locked until the fetch is committed.
+        A fetch started before another one committed fails to serialize
+        on the lock and is retried by the queue with a fresh snapshot,
+        so the same documents are never created twice
+        """
+        self.ensure_one()
+        try:
+            with tools.mute_logger("odoo.sql_db"), self.env.cr.savepoint():
+                self.env.cr.execute(
+                    "SELECT id FROM apix_backend WHERE id = %s FOR UPDATE NOWAIT",
+                    (self.id,),
+                )
+        except LockNotAvailable as error:
+            raise RetryableJobError(
+                _("APIX inbox of '%s' is already being fetched") % self.name,
+                seconds=60,
+                ignore_retry=True,
+            ) from error
+
+        self.sudo().write({"last_fetch": fields.Datetime.now()})
+
+    def _adapt_fetch_interval(self, new_count):
+        """
+        Adapt the fetch interval to the inbox activity: halve it when new
+        invoices were found and double it when not
+
+        :param new_count: number of new invoices found
+        """
+        self.ensure_one()
+
+        interval_min = max(self.fetch_interval_min, 1)
+        interval_max = max(self.fetch_interval_max, interval_min)
+        if new_count:
+            interval = self.fetch_interval // 2
+        else:
+            interval = self.fetch_interval * 2
+        interval = min(max(interval, interval_min), interval_max)
+
+        self.sudo().write(
+            {
+                "fetch_interval": interval,
+                "next_fetch": fields.Datetime.now() + timedelta(minutes=interval),
+            }
+        )
 
     def action_einvoice_refetch(self):
         for record in self:
             # Add fetching to queue
             job_desc = _("APIX refetch invoices for '%s'") % record.name
+            identity_key = get_identity_key(
+                "apix-refetch", record.id, record.refetch_since or ""
+            )
             record.with_context(company_id=record.company_id.id).with_delay(
-                description=job_desc
-            ).list_invoices(refetch=True)
+                description=job_desc, identity_key=identity_key
+            ).list_invoices(refetch=True, refetch_since=record.refetch_since)
+
+    def action_view_inbox_documents(self):
+        self.ensure_one()
+        action = self.env["ir.actions.actions"]._for_xml_id(
+            "connector_apix.action_apix_inbox_document"
+        )
+        action["domain"] = [("backend_id", "=", self.id)]
+        action["context"] = {"default_backend_id": self.id}
+
+        return action
 
-    def list_invoices(self, refetch=False):
+    def list_invoices(self, refetch=False, refetch_since=False):
         """
         Fetch list of invoices from APIX
         This will always fetch everything as there is no filter options.
         Filtering should be added when it will become available
 
+        Documents already seen are stored as inbox documents
+        and only new documents are downloaded
+
         :param refetch: Re-fetch already downloaded invoices
+        :param refetch_since: Only re-fetch documents first seen on or after
+            this date
         :return:
         """
         self.ensure_one()
+        self._lock_fetch()
 
-        # Fetch einvoices
-        invoices = self.ListInvoiceZIPs()
+        inbox_document = self.env["apix.inbox.document"].sudo()
+        known_documents = inbox_document._get_known_documents(self)
+        stale_date = fields.Datetime.now() - timedelta(hours=STALE_DOCUMENT_HOURS)
 
-        _logger.debug("Invoice XML: %s" % ET.tostring(invoices, pretty_print=True))
-        for invoice in invoices.findall(".//Group"):
-            storage_id = invoice.find(".//Value[@type='StorageID']").text
-            storage_key = invoice.find(".//Value[@type='StorageKey']").text
-            storage_status = invoice.find(".//Value[@type='StorageStatus']").text
+        if refetch_since:
+            refetch_since = fields.Datetime.to_datetime(refetch_since)
 
-            document_id_element = invoice.find(".//Value[@type='DocumentID']")
-            if document_id_element is not None:
-                # Document id is better, if it's found
-                document_id = document_id_element.text
-            else:
-                # Storage id is always found, but is less useful
-                document_id = storage_id
+        # Fetch einvoices
+        invoices = self.ListInvoiceZIPs()
+        debug = _logger.isEnabledFor(logging.DEBUG)
+
+        new_values = []
+        download_ids = []
+        ingest_ids = []
+        for invoice in invoices:
+            if debug:
+                _logger.debug("Invoice: %s" % invoice)
+
+            storage_id = invoice["StorageID"]
+            storage_key = invoice.get("StorageKey")
+            storage_status = invoice.get("StorageStatus")
+
+            known_document = known_documents.get(storage_id)
+            if known_document:
+                inbox_id, state, create_date, write_date = known_document
+                if state == "failed" and storage_status == "UNRECEIVED":
+                    # Retry failed imports
+                    download_ids.append(inbox_id)
+                elif (
+                    state in ("new", "queued")
+                    and storage_status == "UNRECEIVED"
+                    and write_date < stale_date
+                ):
+                    # The download job was lost
+                    download_ids.append(inbox_id)
+                elif state == "downloaded" and write_date < stale_date:
+                    # The import job was lost
+                    ingest_ids.append(inbox_id)
+                elif (
+                    refetch
+                    and storage_status == "RECEIVED"
+                    and (not refetch_since or create_date >= refetch_since)
+                ):
+                    download_ids.append(inbox_id)
+                continue
+
+            # Document id is better, if it's found
+            # Storage id is always found, but is less useful
+            document_id = invoice.get("DocumentID") or storage_id
 
             # Try to get sender name
-            sender_name_element = invoice.find(".//Value[@type='SenderName']")
-            if sender_name_element is not None:
-                sender_name = sender_name_element.text
-            else:
-                sender_name = "Unknown"
+            sender_name = invoice.get("SenderName") or "Unknown"
 
             if (
                 storage_status == "UNRECEIVED"
                 or refetch
                 and storage_status == "RECEIVED"
             ):
-                job_desc = _(f"APIX import invoice '{document_id}' from {sender_name}")
-                self.with_delay(description=job_desc).download_invoice(
-                    storage_id, storage_key
+                state = "new"
+            else:
+                state = "received"
+
+            new_values.append(
+                dict(
+                    backend_id=self.id,
+                    storage_id=storage_id,
+                    storage_key=storage_key,
+                    storage_status=storage_status,
+                    document_id=document_id,
+                    sender_name=sender_name,
+                    state=state,
+                )
+            )
+
+        new_documents = inbox_document.create(new_values)
+        documents = new_documents.filtered(lambda d: d.state == "new")
+        documents |= inbox_document.browse(download_ids)
+
+        _logger.debug(
+            f"APIX inbox: {len(new_documents)} new documents, "
+            f"{len(documents)} to download"
+        )
+
+        if ingest_ids:
+            job_desc = _(f"APIX import {len(ingest_ids)} invoices for '{self.name}'")
+            self.with_delay(
+                description=job_desc,
+                identity_key=get_identity_key("apix-ingest", self.id, ingest_ids),
+            ).ingest_documents(ingest_ids)
+
+        if not refetch:
+            self._adapt_fetch_interval(len(new_documents))
+
+        if inbox_document.search_count(
+            [("backend_id", "=", self.id), ("ack_state", "=", "pending")], limit=1
+        ):
+            # Retry marking received, if it failed earlier
+            self._enqueue_acknowledge()
+
+        priority = None
+        if self.use_metadata and documents:
+            documents = self._check_metadata(documents)
+
+        batch_size = max(self.download_batch_size, 1)
+        for index in range(0, len(documents), batch_size):
+            batch = documents[index : index + batch_size]
+            if self.use_metadata:
+                # Documents are sorted by size: small ones first
+                priority = self.fetch_priority + min(index // batch_size, 10)
+            if len(batch) == 1:
+                job_desc = _(
+                    f"APIX import invoice '{batch.document_id}' "
+                    f"from {batch.sender_name}"
+                )
+            else:
+                job_desc = _(f"APIX import {len(batch)} invoices for '{self.name}'")
+
+            self.with_delay(
+                description=job_desc,
+                priority=priority,
+                identity_key=get_identity_key(
+                    "apix-download", self.id, batch.mapped("storage_id")
+                ),
+            ).download_invoices(batch.ids)
+
+        documents.write({"state": "queued", "error": False})
+
+    def _check_metadata(self, documents):
+        """
+        Fetch the metadata of inbox documents before downloading them.
+        Documents that already exist as vendor bills are marked as duplicates
+
+        :param documents: apix.inbox.document
+        :return: the documents to download, smallest first
+        """
+        metadata = self._fetch_metadata(documents)
+
+        for document in documents:
+            values = metadata.get(document.id)
+            if not values:
+                continue
+
+            size = self._get_metadata_value(values, METADATA_SIZE_KEYS)
+            document_values = dict(
+                document_size=int(size) if size.isdigit() else 0,
+                sender_business_id=self._get_metadata_value(
+                    values, METADATA_BUSINESS_ID_KEYS
                 )
+                or False,
+            )
+            if values.get("DocumentID"):
+                document_values["document_id"] = values["DocumentID"]
+            if values.get("SenderName"):
+                document_values["sender_name"] = values["SenderName"]
+            document.write(document_values)
+
+        duplicates = self._find_duplicate_bills(documents)
+        for document in documents.filtered(lambda d: d.id in duplicates):
+            document.write(
+                {
+                    "state": "duplicate",
+                    "move_id": duplicates[document.id].id,
+                    "error": False,
+                    "ack_state": document._get_ack_state(),
+                }
+            )
+
+        _logger.debug(f"APIX inbox: {len(duplicates)} duplicates not downloaded")
 
-    def download_invoice(self, storage_id, storage_key):
+        # Documents without a known size last
+        return documents.filtered(lambda d: d.id not in duplicates).sorted(
+            lambda d: (not d.document_size, d.document_size)
+        )
+
+    @api.model
+    def _get_metadata_value(self, values, keys):
+        # Returns the first metadata value found for the keys
+        for key in keys:
+            if values.get(key):
+                return values[key].strip()
+
+        return ""
+
+    def _fetch_metadata(self, documents):
+        """
+        Fetch the metadata of inbox documents concurrently.
+        Documents whose metadata can't be fetched are simply downloaded
+
+        :param documents: apix.inbox.document
+        :return: dict of document id: dict of metadata values
+        """
+        metadata = dict()
+        for document, _response, content, error in self._fetch_concurrently(
+            documents,
+            lambda d: self._get_metadata_url(d.storage_id, d.storage_key),
+            fetch_content,
+            operation="Metadata",
+        ):
+            if error is not None:
+                _logger.warning(
+                    f"APIX metadata of '{document.document_id}' failed: {error}"
+                )
+                continue
+
+            with content:
+                groups = list(iter_groups(content))
+            if groups:
+                metadata[document.id] = groups[0]
+
+        return metadata
+
+    def _find_duplicate_bills(self, documents):
+        """
+        Find the vendor bills that already exist for inbox documents:
+        same supplier and the same invoice number
+
+        :param documents: apix.inbox.document with the sender business id
+        :return: dict of document id: account.move
+        """
+        documents = documents.filtered("sender_business_id")
+        partner_index = self._get_partner_index(
+            [
+                {
+                    "vat": None,
+                    "business_code": document.sender_business_id,
+                    "edicodes": [],
+                    "ibans": [],
+                }
+                for document in documents
+            ]
+        )
+
+        Partner = self.env["res.partner"]
+        suppliers = dict()
+        for document in documents:
+            partner_id = partner_index.lookup(business_code=document.sender_business_id)
+            if partner_id:
+                partner = Partner.browse(partner_id).commercial_partner_id
+                suppliers[document.id] = partner.id
+
+        if not suppliers:
+            return dict()
+
+        bills = self.env["account.move"].search(
+            [
+                ("company_id", "=", self.company_id.id),
+                ("move_type", "in", ("in_invoice", "in_refund")),
+                # Imported bills are drafts until they are checked,
+                # so only cancelled bills can be imported again
+                ("state", "!=", "cancel"),
+                ("commercial_partner_id", "in", list(set(suppliers.values()))),
+                ("ref", "in", documents.mapped("document_id")),
+            ]
+        )
+        bills_by_key = {
+            (bill.commercial_partner_id.id, bill.ref): bill for bill in bills
+        }
+
+        duplicates = dict()
+        for document in documents:
+            bill = bills_by_key.get((suppliers.get(document.id), document.document_id))
+            if bill:
+                duplicates[document.id] = bill
+
+        return duplicates
+
+    def download_invoices(self, document_ids):
+        """
+        Download inbox documents concurrently and queue their import.
+        A failing document doesn't stop the download of the others
+
+        :param document_ids: apix.inbox.document ids
+        :return: summary of the results
+        """
         self.ensure_one()
 
-        # Download invoice
-        res = self.Download(storage_id, storage_key)
+        # Documents being handled by another job are skipped
+        documents = (
+            self.env["apix.inbox.document"]
+            .sudo()
+            .browse(document_ids)
+            .exists()
+            ._try_lock()
+            .filtered(lambda d: d.state in ("new", "queued", "failed"))
+        )
+        if not documents:
+            return _("Nothing to import")
+
+        downloaded = self.env["apix.inbox.document"].sudo()
+        for document, _response, content, error in self._fetch_concurrently(
+            documents,
+            lambda d: self._get_download_url(d.storage_id, d.storage_key),
+            fetch_content,
+            operation="Download",
+        ):
+            try:
+                if error is not None:
+                    raise error
+
+                with self.env.cr.savepoint():
+                    self._store_invoice_zip(document, content)
+            except Exception as error:
+                _logger.warning(
+                    f"APIX download of '{document.document_id}' failed: {error}"
+                )
+                document.write({"state": "failed", "error": str(error)})
+                continue
+            finally:
+                if content is not None:
+                    content.close()
 
-        return _(f"Imported invoice with id '{res.id}'")
+            document.write({"state": "downloaded", "error": False})
+            downloaded |= document
 
-    # endregion
+        if downloaded:
+            job_desc = _(f"APIX import {len(downloaded)} invoices for '{self.name}'")
+            self.with_delay(
+                description=job_desc,
+                identity_key=get_identity_key("apix-ingest", self.id, downloaded.ids),
+            ).ingest_documents(downloaded.ids)
 
-    def get_digest(self, values):
-        # Returns the digest needed for requests
-        digest_src = ""
+        return _(f"Downloaded {len(downloaded)} of {len(documents)} invoices")
 
-        for value in values:
-            digest_src += values[value] + "+"
+    def ingest_documents(self, document_ids):
+        """
+        Import downloaded inbox documents as vendor bills.
+        Records shared by the documents are prefetched once for the whole
+        batch, and a failing document doesn't stop the import of the others
 
-        # Strip the last "+"
-        digest_src = digest_src[:-1]
-        _logger.debug("Calculating digest from %s" % digest_src)
-        digest = "SHA-256:" + hashlib.sha256(digest_src.encode("utf-8")).hexdigest()
+        :param document_ids: apix.inbox.document ids
+        :return: summary of the results
+        """
+        self.ensure_one()
 
-        return digest
+        # Documents being handled by another job are skipped
+        documents = (
+            self.env["apix.inbox.document"]
+            .sudo()
+            .browse(document_ids)
+            .exists()
+            ._try_lock()
+            .filtered(lambda d: d.state == "downloaded")
+        )
+        if not documents:
+            return _("Nothing to import")
+
+        Attachment = self.env["ir.attachment"].sudo()
+        attachments_by_document = defaultdict(lambda: Attachment)
+        for attachment in Attachment.search(
+            [
+                ("res_model", "=", "apix.inbox.document"),
+                ("res_id", "in", documents.ids),
+            ]
+        ):
+            attachments_by_document[attachment.res_id] |= attachment
+
+        # Parse everything first, so the shared records can be prefetched
+        trees = dict()
+        partner_keys = dict()
+        for document in documents:
+            finvoice = attachments_by_document[document.id].filtered(
+                lambda a: a.name == "invoice.xml"
+            )
+            try:
+                if not finvoice:
+                    raise ValidationError(_("Could not create invoice"))
+                trees[document.id] = ET.fromstring(finvoice.raw)
+                partner_keys[document.id] = get_finvoice_partner_keys(
+                    trees[document.id]
+                )
+            except Exception as error:
+                trees[document.id] = error
 
-    def get_password_hash(self):
-        # Returns a hashed password
-        password_hash = hashlib.sha256(self.password.encode("utf-8")).hexdigest()
+        partner_index, product_ids = self._prefetch_ingest(
+            [tree for tree in trees.values() if not isinstance(tree, Exception)],
+            list(partner_keys.values()),
+        )
 
-        return password_hash
+        AccountMove = self.env["account.move"].with_company(self.company_id)
+        imported = 0
+        for document in documents:
+            attachments = attachments_by_document[document.id]
+            finvoice = attachments.filtered(lambda a: a.name == "invoice.xml")
+            tree = trees[document.id]
 
-    def get_timestamp(self):
-        # Returns the timestamp in the correct format for the REST API
+            try:
+                with self.env.cr.savepoint(), self._apix_measure("import"):
+                    if isinstance(tree, Exception):
+                        raise tree
+
+                    partner_id = partner_index.lookup(**partner_keys[document.id])
+                    move_values = {"move_type": "in_invoice"}
+                    if partner_id:
+                        move_values["partner_id"] = partner_id
+
+                    invoice = AccountMove.with_context(
+                        apix_partner_id=partner_id, apix_product_ids=product_ids
+                    )._import_finvoice(
+                        tree,
+                        AccountMove.create(move_values),
+                        self.company_id.id,
+                    )
+
+                    # Move the attachments from the document to the invoice
+                    (attachments - finvoice).write(
+                        {"res_model": "account.move", "res_id": invoice.id}
+                    )
+                    finvoice.unlink()
+            except Exception as error:
+                _logger.warning(
+                    f"APIX import of '{document.document_id}' failed: {error}"
+                )
+                document.write({"state": "failed", "error": str(error)})
+                continue
+
+            document.write(
+                {
+                    "state": "imported",
+                    "move_id": invoice.id,
+                    "error": False,
+                    "ack_state": document._get_ack_state(),
+                }
+            )
+            imported += 1
+
+        if imported:
+            # Runs only after this import has been committed
+            self._enqueue_acknowledge()
+
+        return _(f"Imported {imported} of {len(documents)} invoices")
+
+    def _enqueue_acknowledge(self):
+        # Queues marking the imported documents received
+        self.ensure_one()
+
+        if not self.acknowledge_received:
+            return
+
+        job_desc = _("APIX mark invoices received for '%s'") % self.name
+        self.with_delay(
+            description=job_desc, identity_key=get_identity_key("apix-ack", self.id)
+        ).acknowledge_documents()
+
+    def acknowledge_documents(self):
+        """
+        Mark the imported documents as received in APIX, all at once.
+        Only documents whose import has been committed are pending,
+        so an invoice is never marked received without being imported
+
+        :return: summary of the results
+        """
+        self.ensure_one()
+
+        documents = (
+            self.env["apix.inbox.document"]
+            .sudo()
+            .search([("backend_id", "=", self.id), ("ack_state", "=", "pending")])
+            ._try_lock()
+            .filtered(lambda d: d.ack_state == "pending")
+        )
+        if not documents or not self.acknowledge_received:
+            return _("Nothing to mark received")
+
+        acknowledged = self.env["apix.inbox.document"].sudo()
+        for document, _response, _content, error in self._fetch_concurrently(
+            documents,
+            lambda d: self._get_download_url(
+                d.storage_id, d.storage_key, mark_received=True
+            ),
+            read_and_discard,
+            operation="markReceived",
+        ):
+            if error is not None:
+                # Stays pending and is tried again on the next run
+                _logger.warning(
+                    f"APIX marking '{document.document_id}' received failed: "
+                    f"{error}"
+                )
+                continue
+
+            acknowledged |= document
+
+        acknowledged.write({"ack_state": "done", "storage_status": "RECEIVED"})
+
+        return _(f"Marked {len(acknowledged)} of {len(documents)} invoices received")
+
+    def _prefetch_ingest(self, trees, partner_keys):
+        """
+        Look up the partners and products the Finvoice documents refer to
+        in a few queries. The import uses them instead of searching them
+        line by line.
+
+        Taxes are still searched for each line by the Finvoice import,
+        they are only loaded to the cache here
+
+        :param trees: parsed Finvoice documents
+        :param partner_keys: seller identifiers of the documents,
+            from get_finvoice_partner_keys
+        :return: PartnerIndex of the sellers
+            and dict of product default code: product id
+        """
+        partner_index = self._get_partner_index(partner_keys)
+
+        product_codes = set()
+        for tree in trees:
+            for row in tree.iter("InvoiceRow"):
+                # The import prefers the buyer's code, like here
+                product_codes.add(
+                    row.findtext("BuyerArticleIdentifier")
+                    or row.findtext("ArticleIdentifier")
+                )
+        product_codes.discard(None)
+        product_codes.discard("")
+
+        product_ids = dict()
+        if product_codes:
+            Product = self.env["product.product"].with_company(self.company_id)
+            for product in Product.search_fetch(
+                [
+                    ("default_code", "in", list(product_codes)),
+                    *Product._check_company_domain(self.company_id),
+                ],
+                ["default_code", "barcode", "name", "product_tmpl_id", "uom_id"],
+            ):
+                product_ids.setdefault(product.default_code, product.id)
+
+        self.env["account.tax"].search_fetch(
+            [
+                ("company_id", "=", self.company_id.id),
+                ("type_tax_use", "=", "purchase"),
+            ],
+            ["amount", "amount_type", "price_include", "sequence", "type_tax_use"],
+        )
+
+        return partner_index, product_ids
+
+    def _get_partner_index(self, partner_keys):
+        """
+        Build a supplier index for the seller identifiers of an import batch
+        with one search
+
+        :param partner_keys: list of dicts from get_finvoice_partner_keys
+        :return: PartnerIndex
+        """
+        Partner = self.env["res.partner"]
+        partner_index = PartnerIndex()
+
+        business_ids = set()
+        edicodes = set()
+        ibans = set()
+        for keys in partner_keys:
+            for value in (keys["vat"], keys["business_code"]):
+                if value:
+                    business_ids.add(value)
+                    business_ids.update(get_business_keys(value))
+            edicodes.update(keys["edicodes"])
+            edicodes.update(normalize(edicode) for edicode in keys["edicodes"])
+            ibans.update(normalize(iban) for iban in keys["ibans"])
+
+        has_edicode = "edicode" in Partner._fields
+        domains = []
+        if business_ids:
+            domains.append([("vat", "in", list(business_ids))])
+            domains.append([("company_registry", "in", list(business_ids))])
+        if edicodes and has_edicode:
+            domains.append([("edicode", "in", list(edicodes))])
+        if ibans:
+            domains.append([("bank_ids.sanitized_acc_number", "in", list(ibans))])
+
+        if not domains:
+            return partner_index
+
+        field_names = ["vat", "company_registry", "company_id", "bank_ids"]
+        if has_edicode:
+            field_names.append("edicode")
+
+        partners = Partner.search_fetch(
+            expression.AND(
+                [
+                    expression.OR(domains),
+                    [
+                        ("type", "=", "contact"),
+                        ("company_id", "in", [False, self.company_id.id]),
+                    ],
+                ]
+            ),
+            field_names,
+        )
+
+        # Company's own partners before shared
+        partners = partners.sorted(lambda p: (not p.company_id, p.id))
+        for partner in partners:
+            partner_index.add("business", partner.vat, partner.id)
+            partner_index.add("business", partner.company_registry, partner.id)
+            if has_edicode:
+                partner_index.add("edicode", partner.edicode, partner.id)
+            for bank in partner.bank_ids:
+                partner_index.add("iban", bank.sanitized_acc_number, partner.id)
+
+        _logger.debug(
+            f"APIX partner index: {len(partners)} partners, "
+            f"{len(partner_index)} identifiers"
+        )
+
+        return partner_index
+
+    def _fetch_concurrently(self, documents, url_getter, fetcher, operation):
+        """
+        Request an url for each document in worker threads, respecting the
+        rate limit and the circuit breaker of the APIX host.
+        The endpoint results and the statistics are registered here
+
+        :param documents: apix.inbox.document
+        :param url_getter: function returning the url of a document
+        :param fetcher: function of session, url and timeout, run in
+            the worker threads. Returns the response, or a tuple of the
+            response and the content file object
+        :param operation: APIX API method, for the statistics
+        :return: generator of (document, response, content, error) tuples,
+            in the order the requests complete
+        """
+        timeout = self._get_timeout()
+        workers = max(min(self.download_concurrency, len(documents)), 1)
+        endpoint = self.env["apix.endpoint"]
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Sessions and urls are prepared here, as the ORM is not thread safe
+            futures = dict()
+            for document in documents:
+                url = url_getter(document)
+                host = urlsplit(url).netloc
+                endpoint._acquire(self, host)
+                future = executor.submit(fetcher, self._get_session(url), url, timeout)
+                futures[future] = (document, host)
+
+            for future in as_completed(futures):
+                document, host = futures[future]
+                error = future.exception()
+                content = None
+                if error is None:
+                    response = future.result()
+                    if isinstance(response, tuple):
+                        response, content = response
+                    endpoint._register_result(self, host, status_code=200)
+                else:
+                    response = getattr(error, "response", None)
+                    endpoint._register_result(
+                        self,
+                        host,
+                        status_code=getattr(response, "status_code", None),
+                        error=response is None,
+                    )
+                self._record_download(
+                    response, content, operation=operation, success=error is None
+                )
+
+                yield document, response, content, error
 
-        now = datetime.datetime.today()
+    def _record_download(
+        self, response, content=None, operation="Download", success=None
+    ):
+        """
+        Store the statistics of a download made in a worker thread
+
+        :param response: requests.Response or None, if the request failed
+        :param content: the downloaded file object, None if the download failed
+        :param operation: APIX API method of the download
+        :param success: whether the request succeeded. By default a request
+            succeeded if there is content
+        """
+        if success is None:
+            success = content is not None
+        values = {"operation": operation, "success": success}
+        if response is not None:
+            values.update(
+                duration_ms=response.elapsed.total_seconds() * 1000,
+                http_status=response.status_code,
+            )
+        if content is not None:
+            values["payload_size"] = content.seek(0, 2)
+            content.seek(0)
 
-        # Construct the timestamp
-        timestamp = now.strftime("%Y%m%d%H%M%S")
+        self.env["apix.call"]._record(self, values)
 
-        return timestamp
+    # endregion
+
+    @tools.ormcache("self.id")
+    def _get_signer(self):
+        # Returns the request signer. Cleared when the password changes
+        return ApixSigner(self.password)
+
+    def get_digest(self, values):
+        # Returns the digest needed for requests
+        return ApixSigner.get_digest(values)
+
+    def get_password_hash(self):
+        # Returns a hashed password
+        return self._get_signer().password_hash
+
+    def get_timestamp(self):
+        # Returns the timestamp in the correct format for the REST API
+        return ApixSigner.get_timestamp()
 
     def get_url(self, command, variables=False):
         # Returns the REST URL based on the environment, command and variables
@@ -319,7 +1418,15 @@ class ApixBackend(models.Model):
 
         terminal_commands = ["list", "list2", "receive", "download", "metadata"]
 
-        if self.environment == "production":
+        if self.environment == "custom":
+            if command in terminal_commands:
+                url = self.custom_terminal_url or ""
+            else:
+                url = self.custom_api_url or ""
+
+            if not url.endswith("/"):
+                url += "/"
+        elif self.environment == "production":
             if command in terminal_commands:
                 url = "https://terminal.apix.fi/"
             else:
@@ -330,20 +1437,91 @@ class ApixBackend(models.Model):
             else:
                 url = "https://test-api.apix.fi/"
 
-        url += "%s?" % command
-
-        for key, value in variables.items():
-            url += "%s=%s&" % (key, value)  # Add variables to the url
+        url += command
 
         if variables:
-            url = url.rstrip("&")  # Strip the last &
+            url += "?" + ApixSigner.get_query(variables)
 
         _logger.debug("Using url %s" % url)
 
         return url
 
-    def get_values_from_url(self, url):
-        response = requests.get(url)
+    @contextmanager
+    def _apix_measure(self, operation):
+        """
+        Measure an APIX call or a processing stage and store its statistics
+
+        :param operation: APIX API method or processing stage name
+        :return: dict for http_status, apix_status_code, payload_size
+            and credits of the call
+        """
+        stat = {"operation": operation, "success": True}
+        start = time.perf_counter()
+        try:
+            yield stat
+        except Exception:
+            stat["success"] = False
+            raise
+        finally:
+            stat["duration_ms"] = (time.perf_counter() - start) * 1000
+            if self:
+                self.env["apix.call"]._record(self, stat)
+
+    def _apix_request(self, method, url, stat=None, **kwargs):
+        """
+        Send a request to APIX using the pooled session of this backend
+
+        :param method: HTTP method
+        :param url: the full url, as returned by get_url
+        :param stat: statistics dict from _apix_measure to fill
+        :return: requests.Response
+        """
+        self.ensure_one()
+
+        session = self._get_session(url)
+        kwargs.setdefault("timeout", self._get_timeout())
+
+        endpoint = self.env["apix.endpoint"]
+        host = urlsplit(url).netloc
+        endpoint._acquire(self, host)
+
+        try:
+            response = session.request(method, url, **kwargs)
+        except RequestException:
+            endpoint._register_result(self, host, error=True)
+            raise
+
+        endpoint._register_result(self, host, status_code=response.status_code)
+
+        if stat is not None:
+            stat["http_status"] = response.status_code
+            data = kwargs.get("data")
+            if data is not None:
+                stat["payload_size"] = len(data)
+            else:
+                stat["payload_size"] = int(response.headers.get("Content-Length", 0))
+
+        return response
+
+    def _get_session(self, url):
+        # Returns the pooled session for the host of the url
+        self.ensure_one()
+
+        return get_session(
+            self.env.cr.dbname,
+            self.id,
+            url,
+            self.http_pool_size,
+            self.http_max_retries,
+            self.http_retry_backoff,
+        )
+
+    def _get_timeout(self):
+        # Returns the (connect, read) timeout for requests
+        return (self.http_connect_timeout, self.http_read_timeout)
+
+    def get_values_from_url(self, url, stat=None):
+        response = self._apix_request("GET", url, stat=stat)
         html = response.text.encode("latin-1")
         root = ET.fromstring(html)
 
@@ -356,6 +1534,9 @@ class ApixBackend(models.Model):
 
         msg = "%s [%s]: %s" % (res_status, res_status_code, res_free_text)
 
+        if stat is not None:
+            stat["apix_status_code"] = res_status_code
+
         if res_status == "ERR":
             _logger.warning(msg)  # Log error message and error
             raise ValidationError(res_free_text)  # Show the human-readable part
@@ -380,19 +1561,22 @@ class ApixBackend(models.Model):
     def RetrieveTransferID(self):
         _logger.debug("APIX RetrieveTransferId")
 
+        signer = self._get_signer()
+
         values = OrderedDict()
         values["id"] = self.business_id
         values["idq"] = self.id_qualifier
         values["uid"] = self.username
-        values["ts"] = self.get_timestamp()
-        values["d"] = self.get_password_hash()
+        values["ts"] = signer.get_timestamp()
+        values["d"] = signer.password_hash
 
         # Get the digest hash
-        values["d"] = self.get_digest(values)
+        signer.sign(values)
 
         command = "app-transferID"
         url = self.get_url(command, values)
-        response = self.get_values_from_url(url)
+        with self._apix_measure("RetrieveTransferID") as stat:
+            response = self.get_values_from_url(url, stat)
 
         if response:
             self.transfer_id = response.get("TransferID", False)
@@ -403,20 +1587,23 @@ class ApixBackend(models.Model):
     def AuthenticateByUser(self):
         _logger.debug("APIX AuthenticateByUser")
 
+        signer = self._get_signer()
+
         values = OrderedDict()
         values["uid"] = self.username
-        values["t"] = self.get_timestamp()
-        values["d"] = self.get_password_hash()
+        values["t"] = signer.get_timestamp()
+        values["d"] = signer.password_hash
 
         # Get the digest hash
-        values["d"] = self.get_digest(values)
+        signer.sign(values)
 
         # Add pass to variables
         values["pass"] = self.password
 
         command = "authuser"
         url = self.get_url(command, values)
-        response = self.get_values_from_url(url)
+        with self._apix_measure("AuthenticateByUser") as stat:
+            response = self.get_values_from_url(url, stat)
 
         if isinstance(response, list):
             # For some reason the res can also be a list with one dict in it (?)
@@ -461,36 +1648,53 @@ class ApixBackend(models.Model):
         else:
             values["TraKey"] = self.transfer_key
 
-        # Get the digest hash
-        values["d"] = self.get_digest(values)
-
+        # Add the digest hash.
         # Remove TransferKey and StorageKey. We don't want them to the url
-        values.pop("TraKey", None)
-        values.pop("StorageKey", None)
+        values = self._get_signer().sign(values, secret_keys=("TraKey", "StorageKey"))
 
         _logger.debug("Using values %s" % values)
 
         return values
 
     def SendInvoiceZIP(self, payload):
+        """
+        Send an invoice payload to APIX
+
+        :param payload: zip file as bytes or as a file object.
+            File objects are uploaded in chunks
+        """
         _logger.debug("APIX SendInvoiceZIP")
         values = self.get_default_url_attributes()
 
         command = "invoices"
         url = self.get_url(command, values)
 
-        # Post the file to the server
-        res = requests.put(url, data=payload)
-        res.raise_for_status()
+        if hasattr(payload, "read"):
+            payload = UploadBody(payload)
+
+        with self._apix_measure("SendInvoiceZIP") as stat:
+            # Post the file to the server
+            res = self._apix_request("PUT", url, data=payload, stat=stat)
+            res.raise_for_status()
+
+            utf8_parser = ET.XMLParser(encoding="utf-8")
+            res_etree = ET.fromstring(res.text.encode("utf-8"), parser=utf8_parser)
 
-        utf8_parser = ET.XMLParser(encoding="utf-8")
-        res_etree = ET.fromstring(res.text.encode("utf-8"), parser=utf8_parser)
+            status_code = res_etree.find(".//StatusCode")
+            if status_code is not None:
+                stat["apix_status_code"] = status_code.text
+            stat["credits"] = get_credits(res_etree)
 
-        self.validateResponse(res_etree)
+            self.validateResponse(res_etree)
 
         return res_etree
 
     def ListInvoiceZIPs(self):
+        """
+        List the documents in the APIX inbox
+
+        :return: generator of dicts, one for each document
+        """
         _logger.debug("APIX ListInvoiceZIPs")
 
         values = self.get_default_url_attributes(show_soft=False, show_ver=False)
@@ -498,69 +1702,159 @@ class ApixBackend(models.Model):
         command = "list2"
         url = self.get_url(command, values)
 
-        # Get invoices from server
-        res = requests.get(url)
-        res.raise_for_status()
+        # Get invoices from server. Only the request is measured,
+        # as the response is read lazily
+        with self._apix_measure("ListInvoiceZIPs") as stat:
+            res = self._apix_request("GET", url, stream=True, stat=stat)
+            res.raise_for_status()
+        res.raw.decode_content = True
 
-        utf8_parser = ET.XMLParser(encoding="utf-8")
-        res_etree = ET.fromstring(res.text.encode("utf-8"), parser=utf8_parser)
+        return self._iter_response_groups(res)
 
-        return res_etree
+    def _iter_response_groups(self, response):
+        """
+        Stream the Groups of a response as dicts and close the response
+        when done
+
+        :param response: a streamed requests.Response
+        :return: generator of dicts
+        """
+        try:
+            yield from iter_groups(response.raw)
+        finally:
+            response.close()
 
-    def Download(self, storage_id, storage_key):
-        _logger.debug("APIX Download")
+    def _get_metadata_url(self, storage_id, storage_key):
         values = self.get_default_url_attributes(
             show_soft=False,
             show_ver=False,
-            mark_received=False,
+            storage_id=storage_id,
+            storage_key=storage_key,
+        )
+
+        command = "metadata"
+
+        return self.get_url(command, values)
+
+    def _get_download_url(self, storage_id, storage_key, mark_received=False):
+        values = self.get_default_url_attributes(
+            show_soft=False,
+            show_ver=False,
+            mark_received=mark_received,
             storage_id=storage_id,
             storage_key=storage_key,
         )
 
         command = "download"
-        company_id = self.company_id.id
-        url = self.get_url(command, values)
 
-        # Download invoice from server
-        res = requests.get(url)
-        res.raise_for_status()
+        return self.get_url(command, values)
+
+    def _store_invoice_zip(self, document, content):
+        """
+        Save the files of a downloaded invoice zip as attachments of the
+        inbox document, to be imported later
+
+        :param document: apix.inbox.document
+        :param content: zip file as a file object
+        :return: the attachments
+        """
+        # Replace the files of an earlier download
+        self.env["ir.attachment"].sudo().search(
+            [
+                ("res_model", "=", "apix.inbox.document"),
+                ("res_id", "=", document.id),
+            ]
+        ).unlink()
+
+        with ZipFile(content) as zip_file:
+            members = [info for info in zip_file.infolist() if not info.is_dir()]
+
+            if not any(info.filename == "invoice.xml" for info in members):
+                raise ValidationError(_("Could not create invoice"))
+
+            return self._create_zip_attachments(
+                zip_file, members, "apix.inbox.document", document.id
+            )
 
-        zip_file = ZipFile(BytesIO(res.content))
-        mime = MimeTypes()
+    def _create_zip_attachments(self, zip_file, members, res_model, res_id):
+        """
+        Save zip members as attachments. With the file storage the members
+        are streamed to the filestore, so they are never kept in memory.
+        Otherwise they are created in size-limited batches
 
-        ir_attachment = self.env["ir.attachment"]
-        attachment_ids = self.env["ir.attachment"]
+        :return: the attachments
+        """
+        company_id = self.company_id.id
+        attachments = self.env["ir.attachment"].sudo()
+        use_filestore = attachments._storage() == "file"
 
-        invoice = False
-        for file_name in zip_file.namelist():
-            # Save to attachments without res_id
-            file_data = zip_file.read(file_name)
-            datas = base64.b64encode(file_data)
+        attachment_values = []
+        batch_size = 0
+        for info in members:
             values = dict(
-                name=file_name,
+                name=info.filename,
                 type="binary",
-                datas=datas,
-                res_model="account.move",
-                mimetype=mime.guess_type(file_name)[0],
+                res_model=res_model,
+                res_id=res_id,
+                mimetype=MIMETYPES.guess_type(info.filename)[0],
                 company_id=company_id,
             )
-
-            if file_name == "invoice.xml":
-                # The actual invoice data
-                invoice = self.env["account.move"]._import_finvoice(
-                    ET.fromstring(file_data),
-                    self.env["account.move"].create({"move_type": "in_invoice"}),
-                    company_id,
-                )
+            if use_filestore:
+                values.update(self._store_zip_member(zip_file, info))
             else:
-                attachment_ids += ir_attachment.create(values)
+                values["raw"] = zip_file.read(info)
+                batch_size += info.file_size
+            attachment_values.append(values)
+
+            if batch_size >= ATTACHMENT_BATCH_SIZE:
+                attachments |= attachments.create(attachment_values)
+                attachment_values = []
+                batch_size = 0
 
-        if not invoice:
-            raise ValidationError(_("Could not create invoice"))
+        if attachment_values:
+            attachments |= attachments.create(attachment_values)
 
-        attachment_ids.write({"res_id": invoice.id})
+        return attachments
 
-        return invoice
+    def _store_zip_member(self, zip_file, info):
+        """
+        Copy a zip member to the filestore in chunks, the same way
+        ir.attachment stores its files
+
+        :return: ir.attachment values of the stored file
+        """
+        Attachment = self.env["ir.attachment"]
+        checksum = hashlib.sha1()
+        file_size = 0
+
+        fd, temp_path = tempfile.mkstemp(dir=Attachment._filestore())
+        try:
+            with zip_file.open(info) as member, os.fdopen(fd, "wb") as temp_file:
+                while True:
+                    chunk = member.read(ATTACHMENT_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    checksum.update(chunk)
+                    temp_file.write(chunk)
+                    file_size += len(chunk)
+
+            checksum = checksum.hexdigest()
+            fname = f"{checksum[:2]}/{checksum}"
+            full_path = Attachment._full_path(fname)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+
+            if not os.path.isfile(full_path):
+                shutil.move(temp_path, full_path)
+            elif not filecmp.cmp(temp_path, full_path, shallow=False):
+                raise UserError(_("The attachment collides with an existing file."))
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+
+        # Removed by the garbage collector if the transaction is rolled back
+        Attachment._mark_for_gc(fname)
+
+        return dict(store_fname=fname, checksum=checksum, file_size=file_size)
 
     def validateResponse(self, response):
         _logger.debug("Response: %s" % ET.tostring(response))
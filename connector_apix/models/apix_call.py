@@ -0,0 +1,167 @@
+import logging
+from datetime import timedelta
+
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+
+class ApixCall(models.Model):
+    # Statistics of APIX API calls and processing stages
+    _name = "apix.call"
+    _description = "APIX Call Statistics"
+    _order = "id desc"
+    _rec_name = "operation"
+
+    backend_id = fields.Many2one(
+        comodel_name="apix.backend",
+        string="APIX Backend",
+        required=True,
+        index=True,
+        ondelete="cascade",
+    )
+
+    operation = fields.Char(
+        string="Operation",
+        required=True,
+        index=True,
+        help="APIX API method (e.g. SendInvoiceZIP) or processing stage "
+        "(render, package, import)",
+    )
+
+    success = fields.Boolean(
+        string="Success",
+        default=True,
+    )
+
+    duration_ms = fields.Float(
+        string="Duration (ms)",
+        group_operator="avg",
+    )
+
+    payload_size = fields.Integer(
+        string="Payload size",
+        help="Bytes sent or received",
+    )
+
+    http_status = fields.Integer(
+        string="HTTP status",
+        group_operator=None,
+    )
+
+    apix_status_code = fields.Char(
+        string="APIX status code",
+    )
+
+    credits = fields.Float(
+        string="Credits",
+    )
+
+    @api.model
+    def _record(self, backend, values):
+        """
+        Store statistics of one call.
+        Written in a separate transaction, so failed calls are recorded too
+        """
+        values = dict(values, backend_id=backend.id)
+        try:
+            with self.pool.cursor() as cr:
+                self.with_env(self.env(cr=cr)).sudo().create(values)
+        except Exception as error:
+            # Statistics must never break the actual work
+            _logger.warning(f"Could not store APIX call statistics: {error}")
+
+    @api.model
+    def _get_aggregates(self, backend, hours=24):
+        """
+        Aggregate the statistics of the last hours per operation
+
+        :return: dict of operation: dict of aggregated values
+        """
+        since = fields.Datetime.now() - timedelta(hours=hours)
+        domain = [("backend_id", "=", backend.id), ("create_date", ">=", since)]
+
+        aggregates = dict()
+        for (
+            operation,
+            count,
+            duration_avg,
+            duration_max,
+            payload_size,
+            credits,
+        ) in self._read_group(
+            domain,
+            ["operation"],
+            [
+                "__count",
+                "duration_ms:avg",
+                "duration_ms:max",
+                "payload_size:sum",
+                "credits:sum",
+            ],
+        ):
+            aggregates[operation] = {
+                "count": count,
+                "errors": 0,
+                "duration_avg": duration_avg or 0,
+                "duration_max": duration_max or 0,
+                "payload_size": payload_size or 0,
+                "credits": credits or 0,
+            }
+
+        for operation, count in self._read_group(
+            domain + [("success", "=", False)], ["operation"], ["__count"]
+        ):
+            aggregates[operation]["errors"] = count
+
+        return aggregates
+
+    @api.model
+    def _get_prometheus_metrics(self, hours=24):
+        """
+        Get the aggregated statistics of all backends
+        in Prometheus text exposition format
+
+        :return: str
+        """
+        metrics = [
+            ("apix_calls", "APIX calls in the window", "count"),
+            ("apix_call_errors", "Failed APIX calls in the window", "errors"),
+            (
+                "apix_call_duration_avg_ms",
+                "Average duration in milliseconds",
+                "duration_avg",
+            ),
+            (
+                "apix_call_duration_max_ms",
+                "Maximum duration in milliseconds",
+                "duration_max",
+            ),
+            ("apix_payload_bytes", "Bytes sent or received", "payload_size"),
+            ("apix_credits", "APIX credits used", "credits"),
+        ]
+
+        aggregates = [
+            (backend, self._get_aggregates(backend, hours))
+            for backend in self.env["apix.backend"].sudo().search([])
+        ]
+
+        lines = []
+        for name, description, key in metrics:
+            lines.append(f"# HELP {name} {description} (last {hours} hours)")
+            lines.append(f"# TYPE {name} gauge")
+            for backend, operations in aggregates:
+                for operation, values in operations.items():
+                    labels = f'backend="{backend.id}",operation="{operation}"'
+                    lines.append(f"{name}{{{labels}}} {values[key]}")
+
+        return "\n".join(lines) + "\n"
+
+    @api.model
+    def _vacuum(self):
+        # Remove statistics older than the backend retention
+        for backend in self.env["apix.backend"].search([]):
+            limit = fields.Datetime.now() - timedelta(days=backend.call_stats_days)
+            self.search(
+                [("backend_id", "=", backend.id), ("create_date", "<", limit)]
+            ).unlink()
@@ -0,0 +1,274 @@
+import logging
+import time
+
+from odoo import _, api, fields, models
+
+from odoo.addons.queue_job.exception import RetryableJobError
+
+_logger = logging.getLogger(__name__)
+
+# Responses telling that APIX is overloaded
+THROTTLE_STATUSES = (429, 503)
+
+# Endpoint rows known to be committed, as (dbname, backend id, host)
+_committed_endpoints = set()
+
+
+class ApixEndpoint(models.Model):
+    # Shared rate limiter and circuit breaker state for each APIX host.
+    # The rows are created in the calling transaction. The state is read
+    # and written with row locks in short, separate transactions,
+    # so all the workers share it
+    _name = "apix.endpoint"
+    _description = "APIX Endpoint"
+    _rec_name = "host"
+
+    _sql_constraints = [
+        (
+            "host_uniq",
+            "unique(backend_id, host)",
+            "Endpoint host must be unique per backend.",
+        ),
+    ]
+
+    backend_id = fields.Many2one(
+        comodel_name="apix.backend",
+        string="APIX Backend",
+        required=True,
+        ondelete="cascade",
+    )
+
+    host = fields.Char(
+        string="Host",
+        required=True,
+    )
+
+    state = fields.Selection(
+        string="Circuit",
+        selection=[
+            ("closed", "Closed"),
+            ("open", "Open"),
+            ("half_open", "Probing"),
+        ],
+        default="closed",
+        required=True,
+    )
+
+    rate = fields.Float(
+        string="Current rate",
+        help="Requests per second currently allowed",
+    )
+
+    tokens = fields.Float()
+
+    last_refill = fields.Float(
+        help="Time of the last token refill, as a timestamp",
+    )
+
+    failures = fields.Integer(
+        string="Consecutive failures",
+    )
+
+    opened_at = fields.Float(
+        help="Time when the circuit was opened or probed, as a timestamp",
+    )
+
+    @api.model
+    def _get_endpoint_settings(self, backend):
+        return {
+            "backend_id": backend.id,
+            "max_rate": backend.rate_limit,
+            "burst": max(backend.rate_limit_burst, 1),
+            "threshold": max(backend.breaker_threshold, 1),
+            "cooldown": backend.breaker_cooldown,
+        }
+
+    @api.model
+    def _prepare_endpoint(self, settings, host):
+        """
+        Create the endpoint row in the current transaction, so it is created
+        in the same transaction as the backend. The row is shared by the
+        workers only after it has been committed
+        """
+        key = (self.env.cr.dbname, settings["backend_id"], host)
+        if key in _committed_endpoints:
+            return
+
+        self.env.cr.execute(
+            """
+            INSERT INTO apix_endpoint (
+                backend_id, host, state, rate, tokens, last_refill, failures,
+                create_uid, create_date, write_uid, write_date
+            )
+            VALUES (
+                %(backend_id)s, %(host)s, 'closed', %(rate)s, %(tokens)s,
+                %(now)s, 0, %(uid)s, now() at time zone 'UTC',
+                %(uid)s, now() at time zone 'UTC'
+            )
+            ON CONFLICT (backend_id, host) DO NOTHING
+            """,
+            {
+                "backend_id": settings["backend_id"],
+                "host": host,
+                "rate": settings["max_rate"],
+                "tokens": settings["burst"],
+                "now": time.time(),
+                "uid": self.env.uid,
+            },
+        )
+
+    @api.model
+    def _lock_endpoint(self, cr, settings, host):
+        """
+        Lock the endpoint row in a separate transaction
+
+        :return: the row as a dict, or None if it is not committed yet
+        """
+        cr.execute(
+            """
+            SELECT id, state, rate, tokens, last_refill, failures, opened_at
+            FROM apix_endpoint
+            WHERE backend_id = %s AND host = %s
+            FOR UPDATE
+            """,
+            (settings["backend_id"], host),
+        )
+        endpoint = cr.dictfetchone()
+
+        key = (cr.dbname, settings["backend_id"], host)
+        if endpoint:
+            _committed_endpoints.add(key)
+        else:
+            _committed_endpoints.discard(key)
+
+        return endpoint
+
+    @api.model
+    def _update_endpoint(self, cr, endpoint, values):
+        # Writes the locked endpoint row with the changed values
+        cr.execute(
+            """
+            UPDATE apix_endpoint
+            SET state = %(state)s,
+                rate = %(rate)s,
+                tokens = %(tokens)s,
+                last_refill = %(last_refill)s,
+                failures = %(failures)s,
+                opened_at = %(opened_at)s,
+                write_date = now() at time zone 'UTC'
+            WHERE id = %(id)s
+            """,
+            dict(endpoint, **values),
+        )
+
+    @api.model
+    def _acquire(self, backend, host):
+        """
+        Wait until a request to the host is allowed.
+
+        Raises a RetryableJobError when the circuit is open,
+        so queued jobs are postponed until APIX is probed again
+        """
+        settings = self._get_endpoint_settings(backend)
+        self._prepare_endpoint(settings, host)
+
+        while True:
+            wait = self._try_acquire(settings, host)
+            if not wait:
+                return
+
+            _logger.debug(f"APIX rate limit reached for {host}, waiting {wait:.2f}s")
+            time.sleep(wait)
+
+    @api.model
+    def _try_acquire(self, settings, host):
+        # Returns the seconds to wait before trying again, or 0 if allowed
+        now = time.time()
+
+        with self.pool.cursor() as cr:
+            endpoint = self._lock_endpoint(cr, settings, host)
+            if not endpoint:
+                # Not limited until the endpoint has been committed
+                return 0
+
+            values = dict()
+
+            if endpoint["state"] != "closed":
+                opened_at = endpoint["opened_at"] or 0
+                retry_in = opened_at + settings["cooldown"] - now
+                if retry_in > 0:
+                    raise RetryableJobError(
+                        _("APIX is not responding (%s), trying again later") % host,
+                        seconds=max(int(retry_in), 1),
+                        ignore_retry=True,
+                    )
+
+                # Let one request through to probe APIX
+                values.update(state="half_open", opened_at=now)
+
+            if settings["max_rate"] > 0:
+                rate = endpoint["rate"] or settings["max_rate"]
+                elapsed = max(now - (endpoint["last_refill"] or now), 0)
+                tokens = min(
+                    settings["burst"], (endpoint["tokens"] or 0) + elapsed * rate
+                )
+
+                if tokens < 1 and endpoint["state"] == "closed":
+                    self._update_endpoint(
+                        cr, endpoint, {"tokens": tokens, "last_refill": now}
+                    )
+                    return (1 - tokens) / rate
+
+                values.update(tokens=max(tokens - 1, 0), last_refill=now)
+
+            if values:
+                self._update_endpoint(cr, endpoint, values)
+
+        return 0
+
+    @api.model
+    def _register_result(self, backend, host, status_code=None, error=False):
+        """
+        Update the rate and the circuit after a request
+
+        :param status_code: HTTP status code of the response
+        :param error: the request failed without a response
+        """
+        settings = self._get_endpoint_settings(backend)
+        throttled = status_code in THROTTLE_STATUSES
+        failed = error or throttled or (status_code or 0) >= 500
+
+        with self.pool.cursor() as cr:
+            endpoint = self._lock_endpoint(cr, settings, host)
+            if not endpoint:
+                return
+
+            rate = endpoint["rate"] or settings["max_rate"]
+
+            if failed:
+                failures = endpoint["failures"] + 1
+                values = {"failures": failures}
+
+                if throttled:
+                    # Back off: halve the rate
+                    values["rate"] = max(rate / 2, settings["max_rate"] / 20)
+
+                if (
+                    endpoint["state"] == "half_open"
+                    or failures >= settings["threshold"]
+                ):
+                    _logger.warning(f"APIX circuit opened for {host}")
+                    values.update(state="open", opened_at=time.time())
+            else:
+                # Recover slowly: increase the rate in steps
+                max_rate = settings["max_rate"]
+                values = {
+                    "failures": 0,
+                    "state": "closed",
+                    "rate": min(rate + max_rate / 10, max_rate),
+                }
+                if endpoint["state"] != "closed":
+                    _logger.info(f"APIX circuit closed for {host}")
+
+            if any(endpoint[key] != value for key, value in values.items()):
+                self._update_endpoint(cr, endpoint, values)
@@ -0,0 +1,181 @@
+import logging
+
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+
+class ApixInboxDocument(models.Model):
+    # Documents seen in the APIX inbox (list2)
+    _name = "apix.inbox.document"
+    _description = "APIX Inbox Document"
+    _order = "id desc"
+    _rec_name = "document_id"
+
+    _sql_constraints = [
+        (
+            "storage_uniq",
+            "unique(backend_id, storage_id)",
+            "Storage ID must be unique per backend.",
+        ),
+    ]
+
+    backend_id = fields.Many2one(
+        comodel_name="apix.backend",
+        string="APIX Backend",
+        required=True,
+        index=True,
+        ondelete="cascade",
+    )
+
+    storage_id = fields.Char(
+        string="Storage ID",
+        required=True,
+        readonly=True,
+    )
+
+    storage_key = fields.Char(
+        string="Storage key",
+        readonly=True,
+    )
+
+    storage_status = fields.Char(
+        string="APIX status",
+        readonly=True,
+        help="StorageStatus of the document when it was last seen",
+    )
+
+    document_id = fields.Char(
+        string="Document ID",
+        readonly=True,
+    )
+
+    sender_name = fields.Char(
+        string="Sender",
+        readonly=True,
+    )
+
+    sender_business_id = fields.Char(
+        string="Sender business ID",
+        readonly=True,
+        help="From the document metadata",
+    )
+
+    document_size = fields.Integer(
+        string="Size",
+        readonly=True,
+        help="Document size in bytes, from the document metadata",
+    )
+
+    state = fields.Selection(
+        string="State",
+        selection=[
+            ("new", "New"),
+            ("queued", "Queued"),
+            ("downloaded", "Downloaded"),
+            ("imported", "Imported"),
+            ("duplicate", "Duplicate"),
+            ("failed", "Failed"),
+            ("received", "Received elsewhere"),
+        ],
+        default="new",
+        required=True,
+        index=True,
+    )
+
+    ack_state = fields.Selection(
+        string="Marked received",
+        selection=[
+            ("pending", "Pending"),
+            ("done", "Done"),
+        ],
+        readonly=True,
+        index=True,
+        help="Whether the document has been marked received in APIX",
+    )
+
+    move_id = fields.Many2one(
+        comodel_name="account.move",
+        string="Invoice",
+        readonly=True,
+        ondelete="set null",
+    )
+
+    error = fields.Text(
+        string="Error",
+        readonly=True,
+    )
+
+    @api.model
+    def _get_known_documents(self, backend):
+        """
+        Get the documents already seen for a backend
+
+        :return: dict of storage id: (id, state, create date, write date)
+        """
+        self.flush_model()
+        self.env.cr.execute(
+            """
+            SELECT storage_id, id, state, create_date, write_date
+            FROM apix_inbox_document
+            WHERE backend_id = %s
+            """,
+            (backend.id,),
+        )
+
+        return {row[0]: row[1:] for row in self.env.cr.fetchall()}
+
+    def _try_lock(self):
+        """
+        Lock the documents until the end of the transaction.
+        Documents locked by another transaction are left out, so concurrent
+        jobs never handle the same document
+
+        :return: the locked documents, with fresh values
+        """
+        if not self:
+            return self
+
+        self.flush_recordset()
+        self.env.cr.execute(
+            """
+            SELECT id
+            FROM apix_inbox_document
+            WHERE id IN %s
+            FOR UPDATE SKIP LOCKED
+            """,
+            (tuple(self.ids),),
+        )
+        locked_ids = {row[0] for row in self.env.cr.fetchall()}
+
+        locked = self.filtered(lambda d: d.id in locked_ids)
+        locked.invalidate_recordset()
+
+        if len(locked) < len(self):
+            _logger.info(
+                f"{len(self) - len(locked)} APIX documents are being handled "
+                "by another job, skipping them"
+            )
+
+        return locked
+
+    def _get_ack_state(self):
+        # Returns the ack state of an imported document. Documents that are
+        # already received in APIX don't need to be marked
+        self.ensure_one()
+
+        if not self.backend_id.acknowledge_received:
+            return False
+
+        return "done" if self.storage_status == "RECEIVED" else "pending"
+
+    def _set_failed(self, error):
+        """
+        Mark the documents as failed.
+        This is written in a separate transaction, as the current one is
+        about to be rolled back
+        """
+        with self.pool.cursor() as cr:
+            self.with_env(self.env(cr=cr)).write(
+                {"state": "failed", "error": str(error)}
+            )
@@ -0,0 +1,274 @@
+import logging
+import os
+import shutil
+import time
+import uuid
+from datetime import timedelta
+
+from odoo import _, api, fields, models
+from odoo.exceptions import UserError
+
+from ..tools.identity import get_identity_key
+
+_logger = logging.getLogger(__name__)
+
+# Payload files are kept in this filestore directory until they are uploaded
+PAYLOAD_DIRECTORY = "apix_outbox"
+
+# Packaged entries not uploaded in this time are marked failed
+STALE_PACKAGED_DAYS = 1
+
+# Payloads of finished uploads, e.g. in debug mode, are kept this long
+PAYLOAD_RETENTION_DAYS = 30
+
+
+class ApixOutbox(models.Model):
+    # Invoice uploads to APIX.
+    # Upload states are committed right away, so an invoice is never
+    # uploaded twice even if the sending transaction fails afterwards
+    _name = "apix.outbox"
+    _description = "APIX Outbox"
+    _order = "id desc"
+    _rec_name = "move_id"
+
+    move_id = fields.Many2one(
+        comodel_name="account.move",
+        string="Invoice",
+        required=True,
+        index=True,
+        ondelete="cascade",
+    )
+
+    backend_id = fields.Many2one(
+        comodel_name="apix.backend",
+        string="APIX Backend",
+        required=True,
+        ondelete="cascade",
+    )
+
+    state = fields.Selection(
+        string="State",
+        selection=[
+            ("packaged", "Packaged"),
+            ("uploading", "Uploading"),
+            ("accepted", "Accepted"),
+            ("recorded", "Recorded"),
+            ("failed", "Failed"),
+        ],
+        default="packaged",
+        required=True,
+        index=True,
+        help="Uploading: upload has started, but the result is not known.\n"
+        "Accepted: APIX has accepted the invoice, "
+        "but it is not yet marked as sent",
+    )
+
+    payload_hash = fields.Char(
+        string="Payload hash",
+        help="SHA-256 of the uploaded payload",
+    )
+
+    payload_fname = fields.Char(
+        string="Payload file",
+        help="Packaged payload waiting for upload, relative to the filestore. "
+        "Kept after the upload only in debug mode",
+        copy=False,
+    )
+
+    date_uploaded = fields.Datetime(
+        string="Uploaded",
+    )
+
+    response = fields.Text(
+        string="Response",
+    )
+
+    apix_batch_id = fields.Char(
+        string="APIX Batch ID",
+    )
+
+    apix_accepted_document_id = fields.Char(
+        string="APIX ID",
+    )
+
+    apix_cost_in_credits = fields.Float(
+        string="Cost in credits",
+    )
+
+    error = fields.Text(
+        string="Error",
+    )
+
+    def _get_payload_path(self):
+        # Returns the full path of the payload file
+        self.ensure_one()
+
+        return self.env["ir.attachment"]._full_path(self.payload_fname)
+
+    def _store_payload(self, payload):
+        """
+        Stream a payload to the filestore, without reading it into memory
+
+        :param payload: zip file as a file object
+        """
+        self.ensure_one()
+
+        self.payload_fname = f"{PAYLOAD_DIRECTORY}/{uuid.uuid4().hex}"
+        file_path = self._get_payload_path()
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as target:
+            shutil.copyfileobj(payload, target)
+
+    def _remove_payload(self):
+        # Removes the payload files. The file names are kept, as the entries
+        # may have been written in a separate transaction
+        for record in self.filtered("payload_fname"):
+            try:
+                os.unlink(record._get_payload_path())
+            except FileNotFoundError:
+                continue
+            except OSError as error:
+                _logger.warning(f"Could not remove APIX payload: {error}")
+
+    def _get_upload_results(self):
+        """
+        Get the upload results of accepted entries
+
+        :return: list of dicts, like account.move._einvoice_upload
+        """
+        return [
+            dict(
+                outbox_id=outbox.id,
+                move_id=outbox.move_id.id,
+                backend_id=outbox.backend_id.id,
+                response=outbox.response,
+                apix_batch_id=outbox.apix_batch_id,
+                apix_accepted_document_id=outbox.apix_accepted_document_id,
+                apix_cost_in_credits=outbox.apix_cost_in_credits,
+            )
+            for outbox in self
+        ]
+
+    @api.model
+    def _create_committed(self, vals_list):
+        """
+        Create outbox entries in a separate, immediately committed transaction.
+
+        If the invoices or the backend are not committed yet, e.g. when an
+        invoice is created and sent in the same transaction, the entries are
+        created in the current transaction instead
+
+        :return: the created entries in the current environment
+        """
+        move_ids = {values["move_id"] for values in vals_list}
+        backend_ids = {values["backend_id"] for values in vals_list}
+
+        with self.pool.cursor() as cr:
+            env = self.env(cr=cr)
+            moves = env["account.move"].browse(move_ids).exists()
+            backends = env["apix.backend"].browse(backend_ids).exists()
+            committed = len(moves) == len(move_ids) and len(backends) == len(
+                backend_ids
+            )
+            if committed:
+                outbox_ids = self.with_env(env).create(vals_list).ids
+
+        if not committed:
+            _logger.debug("APIX outbox: invoice not committed, using current cursor")
+            return self.create(vals_list)
+
+        return self.browse(outbox_ids)
+
+    def _write_committed(self, values_by_id):
+        """
+        Write outbox entries in a separate, immediately committed transaction.
+        The entries must not have been written in the current transaction.
+        Entries created in the current transaction are written there
+
+        :param values_by_id: dict of outbox id: values
+        """
+        with self.pool.cursor() as cr:
+            Outbox = self.with_env(self.env(cr=cr))
+            committed_ids = Outbox.browse(list(values_by_id)).exists().ids
+            for outbox_id in committed_ids:
+                Outbox.browse(outbox_id).write(values_by_id[outbox_id])
+
+        self.invalidate_recordset()
+
+        for outbox_id, values in values_by_id.items():
+            if outbox_id not in committed_ids:
+                self.browse(outbox_id).write(values)
+
+    def action_retry(self):
+        # Allow sending again after an interrupted upload has been verified
+        for record in self:
+            if record.state != "uploading":
+                raise UserError(_("Only interrupted uploads can be retried."))
+
+            record.write({"state": "failed", "error": _("Upload interrupted, retried")})
+
+    def action_upload_again(self):
+        # Upload a failed payload again, e.g. after fixing the APIX settings
+        for record in self:
+            if record.state != "failed" or not record.payload_fname:
+                raise UserError(
+                    _("Only failed uploads with a payload can be uploaded again.")
+                )
+
+            record.write({"state": "packaged", "error": False})
+
+            job_desc = _("APIX upload invoice '%s'") % record.move_id.name
+            record.move_id.with_delay(
+                description=job_desc,
+                identity_key=get_identity_key("apix-upload", record.id),
+            ).einvoice_send_upload(record.id)
+
+    @api.model
+    def _vacuum(self):
+        """
+        Fail the packaged entries whose upload was never run, e.g. because
+        the job was cancelled, and remove the old and orphaned payload files
+        """
+        now = fields.Datetime.now()
+
+        stale = self.search(
+            [
+                ("state", "=", "packaged"),
+                ("write_date", "<", now - timedelta(days=STALE_PACKAGED_DAYS)),
+            ]
+        )
+        stale.write({"state": "failed", "error": _("Upload was not started")})
+
+        expired = self.search(
+            [
+                ("payload_fname", "!=", False),
+                ("state", "in", ["accepted", "recorded", "failed"]),
+                ("write_date", "<", now - timedelta(days=PAYLOAD_RETENTION_DAYS)),
+            ]
+        )
+        expired._remove_payload()
+        expired.write({"payload_fname": False})
+
+        self._remove_orphaned_payloads()
+
+    @api.model
+    def _remove_orphaned_payloads(self):
+        # Removes payload files without an outbox entry, e.g. from
+        # a packaging transaction that failed after writing the file
+        directory = self.env["ir.attachment"]._full_path(PAYLOAD_DIRECTORY)
+        if not os.path.isdir(directory):
+            return
+
+        known = set(
+            self.search([("payload_fname", "!=", False)]).mapped("payload_fname")
+        )
+        limit = time.time() - STALE_PACKAGED_DAYS * 24 * 60 * 60
+
+        for file_name in os.listdir(directory):
+            file_path = os.path.join(directory, file_name)
+            if (
+                f"{PAYLOAD_DIRECTORY}/{file_name}" not in known
+                and os.path.getmtime(file_path) < limit
+            ):
+                _logger.info(f"Removing orphaned APIX payload {file_name}")
+                os.unlink(file_path)
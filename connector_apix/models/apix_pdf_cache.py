@@ -0,0 +1,106 @@
+import base64
+import logging
+
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+
+class ApixPdfCache(models.Model):
+    # Rendered invoice PDFs, reused when the invoice hasn't changed
+    _name = "apix.pdf.cache"
+    _description = "APIX PDF Cache"
+    _order = "last_used desc"
+
+    _sql_constraints = [
+        ("key_uniq", "unique(key)", "PDF cache key must be unique."),
+    ]
+
+    key = fields.Char(
+        required=True,
+        index=True,
+        help="Hash of the invoice contents and the report template",
+    )
+
+    backend_id = fields.Many2one(
+        comodel_name="apix.backend",
+        required=True,
+        index=True,
+        ondelete="cascade",
+    )
+
+    move_id = fields.Many2one(
+        comodel_name="account.move",
+        string="Invoice",
+        required=True,
+        index=True,
+        ondelete="cascade",
+    )
+
+    pdf = fields.Binary(
+        string="PDF",
+        attachment=True,
+    )
+
+    size = fields.Integer()
+
+    last_used = fields.Datetime(
+        default=fields.Datetime.now,
+        index=True,
+    )
+
+    @api.model
+    def _get_pdf(self, key):
+        """
+        Get a cached PDF and mark it as used
+
+        :return: PDF as bytes or False
+        """
+        entry = self.search([("key", "=", key)], limit=1)
+        if not entry:
+            return False
+
+        entry.last_used = fields.Datetime.now()
+
+        return base64.b64decode(entry.pdf)
+
+    @api.model
+    def _set_pdf(self, key, backend, move, pdf):
+        # Only the latest PDF of an invoice is kept. Older ones have
+        # a different key, and are never used again
+        self.search(["|", ("key", "=", key), ("move_id", "=", move.id)]).unlink()
+        self.create(
+            {
+                "key": key,
+                "backend_id": backend.id,
+                "move_id": move.id,
+                "pdf": base64.b64encode(pdf),
+                "size": len(pdf),
+            }
+        )
+        self._evict(backend)
+
+    @api.model
+    def _evict(self, backend):
+        """Remove the least recently used PDFs when the cache is too large"""
+        max_size = backend.pdf_cache_max_mb * 1024 * 1024
+
+        self.env.cr.execute(
+            """
+            SELECT id, size FROM apix_pdf_cache
+            WHERE backend_id = %s
+            ORDER BY last_used DESC, id DESC
+            """,
+            (backend.id,),
+        )
+
+        total_size = 0
+        evict_ids = []
+        for entry_id, size in self.env.cr.fetchall():
+            total_size += size or 0
+            if total_size > max_size:
+                evict_ids.append(entry_id)
+
+        if evict_ids:
+            _logger.debug(f"Evicting {len(evict_ids)} PDFs from APIX PDF cache")
+            self.browse(evict_ids).unlink()
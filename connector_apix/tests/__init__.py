@@ -0,0 +1,3 @@
+from . import test_tools
+from . import test_finvoice_apix_fields
+from . import test_inbox
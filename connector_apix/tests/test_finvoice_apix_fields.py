@@ -0,0 +1,75 @@
+from lxml import etree
+
+from odoo.tests import TransactionCase, tagged
+
+FINVOICE = (
+    b'<?xml version="1.0" encoding="ISO-8859-15"?>\n'
+    b'<Finvoice Version="3.0"><InvoiceDetails/></Finvoice>'
+)
+
+
+@tagged("post_install", "-at_install")
+class TestFinvoiceApixFields(TransactionCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.AccountMove = cls.env["account.move"]
+
+    def get_url_fields(self, finvoice):
+        # Returns the file reference names and urls of a Finvoice
+        root = etree.fromstring(finvoice)
+        return (
+            [element.text for element in root.iter("InvoiceUrlNameText")],
+            [element.text for element in root.iter("InvoiceUrlText")],
+        )
+
+    def test_add_pdf(self):
+        finvoice = self.AccountMove.add_finvoice_apix_fields(FINVOICE)
+
+        self.assertTrue(finvoice.startswith(FINVOICE[:-10]))
+        self.assertEqual(
+            self.get_url_fields(finvoice),
+            (["APIX_PDFFILE"], ["file://invoice.pdf"]),
+        )
+
+    def test_add_attachments(self):
+        finvoice = self.AccountMove.add_finvoice_apix_fields(
+            FINVOICE,
+            attachments=True,
+            pdf_name="INV-1.pdf",
+            attachments_name="INV-1.zip",
+        )
+
+        self.assertEqual(
+            self.get_url_fields(finvoice),
+            (
+                ["APIX_PDFFILE", "APIX_ATTACHMENT"],
+                ["file://INV-1.pdf", "file://INV-1.zip"],
+            ),
+        )
+
+    def test_add_twice(self):
+        finvoice = self.AccountMove.add_finvoice_apix_fields(FINVOICE)
+
+        self.assertEqual(self.AccountMove.add_finvoice_apix_fields(finvoice), finvoice)
+
+    def test_replace_references(self):
+        finvoice = self.AccountMove.add_finvoice_apix_fields(
+            FINVOICE, pdf_name="old.pdf"
+        )
+        finvoice = self.AccountMove.add_finvoice_apix_fields(finvoice)
+
+        self.assertEqual(
+            self.get_url_fields(finvoice),
+            (["APIX_PDFFILE"], ["file://invoice.pdf"]),
+        )
+        self.assertIn(b"ISO-8859-15", finvoice.split(b"?>")[0])
+
+    def test_escape_encoding(self):
+        finvoice = self.AccountMove.add_finvoice_apix_fields(
+            FINVOICE, pdf_name="laskun liite & €.pdf"
+        )
+
+        self.assertEqual(
+            self.get_url_fields(finvoice)[1], ["file://laskun liite & €.pdf"]
+        )
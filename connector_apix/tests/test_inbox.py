@@ -0,0 +1,131 @@
+import threading
+
+from odoo.tests import tagged
+
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+from odoo.addons.queue_job.tests.common import trap_jobs
+
+from ..tools import fake_apix
+from ..tools.session import close_sessions
+
+
+@tagged("post_install", "-at_install")
+class TestApixInbox(AccountTestInvoicingCommon):
+    # Fetches invoices from the fake APIX server through the whole
+    # list -> download -> ingest -> acknowledge pipeline
+
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+
+        cls.server = fake_apix.get_server(port=0, invoices=3)
+        server_thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        server_thread.start()
+        cls.addClassCleanup(cls.server.server_close)
+        cls.addClassCleanup(cls.server.shutdown)
+
+        url = "http://127.0.0.1:%s" % cls.server.server_address[1]
+        cls.backend = cls.env["apix.backend"].create(
+            {
+                "name": "Fake APIX",
+                "company_id": cls.company_data["company"].id,
+                "username": "apix@example.com",
+                "password": "password",
+                "environment": "custom",
+                "custom_api_url": url,
+                "custom_terminal_url": url,
+                "transfer_id": "transfer-id",
+                "transfer_key": "transfer-key",
+                "state": "confirmed",
+                "download_concurrency": 2,
+                "download_batch_size": 10,
+                "rate_limit": 0,
+            }
+        )
+        cls.addClassCleanup(close_sessions, cls.env.cr.dbname, cls.backend.id)
+
+        # Seller of the first invoice in the fake inbox
+        cls.supplier = cls.env["res.partner"].create(
+            {
+                "name": "Supplier 0",
+                "company_registry": "1000000-0",
+            }
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.server.state.received.clear()
+
+    def get_documents(self):
+        return self.env["apix.inbox.document"].search(
+            [("backend_id", "=", self.backend.id)], order="storage_id"
+        )
+
+    def test_fetch(self):
+        with trap_jobs() as trap:
+            self.backend.list_invoices()
+
+            documents = self.get_documents()
+            self.assertEqual(
+                documents.mapped("storage_id"),
+                ["storage-0", "storage-1", "storage-2"],
+            )
+            self.assertEqual(set(documents.mapped("state")), {"queued"})
+            trap.assert_jobs_count(1, only=self.backend.download_invoices)
+
+            trap.perform_enqueued_jobs()
+            self.assertEqual(
+                set(documents.mapped("state")),
+                {"downloaded"},
+                documents.mapped("error"),
+            )
+            trap.assert_jobs_count(1, only=self.backend.ingest_documents)
+
+            trap.perform_enqueued_jobs()
+            self.assertEqual(
+                set(documents.mapped("state")),
+                {"imported"},
+                documents.mapped("error"),
+            )
+            self.assertEqual(documents[0].move_id.partner_id, self.supplier)
+            self.assertEqual(set(documents.mapped("ack_state")), {"pending"})
+            # Nothing is marked received before the import is done
+            self.assertFalse(self.server.state.received)
+            trap.assert_jobs_count(1, only=self.backend.acknowledge_documents)
+
+            trap.perform_enqueued_jobs()
+            self.assertEqual(set(documents.mapped("ack_state")), {"done"})
+            self.assertEqual(self.server.state.received, {0, 1, 2})
+
+    def test_fetch_known_documents(self):
+        with trap_jobs() as trap:
+            self.backend.list_invoices()
+            trap.perform_enqueued_jobs()
+
+            # Downloaded documents are not downloaded again
+            self.backend.list_invoices()
+            trap.assert_jobs_count(0, only=self.backend.download_invoices)
+            self.assertEqual(len(self.get_documents()), 3)
+
+    def test_metadata_duplicates(self):
+        self.backend.use_metadata = True
+        bill = self.env["account.move"].create(
+            {
+                "move_type": "in_invoice",
+                "partner_id": self.supplier.id,
+                "ref": "BENCH-0",
+            }
+        )
+        cancelled_bill = bill.copy({"ref": "BENCH-0"})
+        cancelled_bill.button_cancel()
+
+        with trap_jobs() as trap:
+            self.backend.list_invoices()
+
+        documents = self.get_documents()
+        self.assertEqual(documents.mapped("state"), ["duplicate", "queued", "queued"])
+        self.assertEqual(documents[0].move_id, bill)
+        self.assertEqual(documents[0].sender_business_id, "1000000-0")
+        trap.assert_enqueued_job(
+            self.backend.download_invoices, args=(documents[1:].ids,)
+        )
@@ -0,0 +1,160 @@
+import hashlib
+from collections import OrderedDict
+from io import BytesIO
+
+from lxml import etree as ET
+
+from odoo.tests import BaseCase, tagged
+
+from ..tools.fake_apix import get_response_xml
+from ..tools.identity import get_identity_key
+from ..tools.partner_index import (
+    PartnerIndex,
+    get_business_keys,
+    get_finvoice_partner_keys,
+    normalize,
+)
+from ..tools.response import get_credits, iter_groups
+from ..tools.signer import ApixSigner
+
+
+@tagged("post_install", "-at_install")
+class TestApixSigner(BaseCase):
+    def test_password_hash(self):
+        signer = ApixSigner("secret")
+        self.assertEqual(signer.password_hash, hashlib.sha256(b"secret").hexdigest())
+
+    def test_digest(self):
+        values = OrderedDict([("a", "1"), ("b", "2")])
+        self.assertEqual(
+            ApixSigner.get_digest(values),
+            "SHA-256:" + hashlib.sha256(b"1+2").hexdigest(),
+        )
+
+    def test_sign_drops_secret_keys(self):
+        values = OrderedDict([("TraID", "id"), ("TraKey", "key"), ("t", "1")])
+        digest = ApixSigner.get_digest(values)
+
+        signed = ApixSigner("secret").sign(values, secret_keys=("TraKey",))
+        self.assertEqual(list(signed), ["TraID", "t", "d"])
+        self.assertEqual(signed["d"], digest)
+
+    def test_timestamp(self):
+        timestamp = ApixSigner.get_timestamp()
+        self.assertEqual(len(timestamp), 14)
+        self.assertTrue(timestamp.isdigit())
+
+    def test_query(self):
+        values = OrderedDict([("b", "a b"), ("a", "SHA-256:x/y")])
+        self.assertEqual(ApixSigner.get_query(values), "b=a%20b&a=SHA-256:x%2Fy")
+
+
+@tagged("post_install", "-at_install")
+class TestApixResponse(BaseCase):
+    def test_iter_groups(self):
+        xml = get_response_xml(
+            [
+                {"StorageID": "1", "DocumentID": "A"},
+                {"StorageID": "2"},
+            ]
+        )
+        self.assertEqual(
+            list(iter_groups(BytesIO(xml))),
+            [{"StorageID": "1", "DocumentID": "A"}, {"StorageID": "2"}],
+        )
+
+    def test_iter_groups_first_value(self):
+        xml = (
+            b"<Response><Content><Group>"
+            b'<Value type="A">1</Value><Value type="A">2</Value>'
+            b"</Group></Content></Response>"
+        )
+        self.assertEqual(list(iter_groups(BytesIO(xml))), [{"A": "1"}])
+
+    def test_iter_groups_empty(self):
+        self.assertEqual(list(iter_groups(BytesIO(get_response_xml()))), [])
+
+    def test_get_credits(self):
+        response = ET.fromstring(get_response_xml([{"CostInCredits": "1.5"}]))
+        self.assertEqual(get_credits(response), 1.5)
+
+    def test_get_credits_invalid(self):
+        for groups in ([], [{"CostInCredits": ""}], [{"CostInCredits": "n/a"}]):
+            response = ET.fromstring(get_response_xml(groups))
+            self.assertEqual(get_credits(response), 0.0)
+
+
+@tagged("post_install", "-at_install")
+class TestApixPartnerIndex(BaseCase):
+    def test_business_keys(self):
+        self.assertEqual(normalize(" fi-1234 567.8 "), "FI12345678")
+        self.assertEqual(get_business_keys("1234567-8"), ["12345678", "FI12345678"])
+        self.assertEqual(get_business_keys("FI12345678"), ["FI12345678"])
+        self.assertEqual(get_business_keys(None), [])
+
+    def test_lookup_business_id(self):
+        partner_index = PartnerIndex()
+        partner_index.add("business", "1234567-8", 1)
+
+        self.assertEqual(partner_index.lookup(vat="FI12345678"), 1)
+        self.assertEqual(partner_index.lookup(business_code="1234567-8"), 1)
+        self.assertIsNone(partner_index.lookup(vat="FI87654321"))
+
+    def test_first_partner_wins(self):
+        partner_index = PartnerIndex()
+        partner_index.add("business", "FI12345678", 1)
+        partner_index.add("business", "FI12345678", 2)
+
+        self.assertEqual(partner_index.lookup(vat="FI12345678"), 1)
+        self.assertEqual(len(partner_index), 1)
+
+    def test_lookup_edicode_and_iban(self):
+        partner_index = PartnerIndex()
+        partner_index.add("edicode", "003712345678", 1)
+        partner_index.add("iban", "FI21 1234 5600 0007 85", 2)
+
+        self.assertEqual(partner_index.lookup(edicodes=["003712345678"]), 1)
+        self.assertEqual(partner_index.lookup(ibans=["FI2112345600000785"]), 2)
+
+    def test_lookup_edicode_only_without_business_id(self):
+        partner_index = PartnerIndex()
+        partner_index.add("edicode", "003712345678", 1)
+
+        self.assertIsNone(
+            partner_index.lookup(business_code="1234567-8", edicodes=["003712345678"])
+        )
+
+    def test_finvoice_partner_keys(self):
+        tree = ET.fromstring(
+            b"<Finvoice>"
+            b"<SellerPartyDetails>"
+            b"<SellerPartyIdentifier>1234567-8</SellerPartyIdentifier>"
+            b"<SellerOrganisationTaxCode>FI12345678</SellerOrganisationTaxCode>"
+            b"</SellerPartyDetails>"
+            b"<SellerOrganisationUnitNumber>003712345678</SellerOrganisationUnitNumber>"
+            b"<SellerInformationDetails><SellerAccountDetails>"
+            b"<SellerAccountID>FI2112345600000785</SellerAccountID>"
+            b"</SellerAccountDetails></SellerInformationDetails>"
+            b"</Finvoice>"
+        )
+        self.assertEqual(
+            get_finvoice_partner_keys(tree),
+            {
+                "vat": "FI12345678",
+                "business_code": "1234567-8",
+                "edicodes": ["003712345678"],
+                "ibans": ["FI2112345600000785"],
+            },
+        )
+
+
+@tagged("post_install", "-at_install")
+class TestApixIdentity(BaseCase):
+    def test_identity_key(self):
+        self.assertEqual(get_identity_key("apix-fetch", 1), "apix-fetch-1")
+
+    def test_identity_key_ids(self):
+        key = get_identity_key("apix-download", 1, [3, 2])
+        self.assertEqual(key, get_identity_key("apix-download", 1, [2, 3]))
+        self.assertNotEqual(key, get_identity_key("apix-download", 1, [2, 4]))
+        self.assertEqual(len(key.rsplit("-", 1)[-1]), 16)
@@ -0,0 +1,5 @@
+from . import identity
+from . import partner_index
+from . import response
+from . import session
+from . import signer
@@ -0,0 +1,176 @@
+"""
+Benchmark harness for the APIX connector.
+
+Measures payload building, sending, inbox listing and downloading with
+importing against a backend, usually one pointing to the fake APIX server
+in fake_apix.py. Run it in an Odoo shell on a disposable database, as
+sending marks the invoices as sent:
+
+    from odoo.addons.connector_apix.tools.benchmark import run
+    run(env, env["apix.backend"].browse(1), invoices=50)
+"""
+import logging
+import time
+from contextlib import contextmanager
+from statistics import median
+
+_logger = logging.getLogger(__name__)
+
+
+class BenchmarkResult:
+    # Timings of one benchmark run
+    def __init__(self):
+        self.timings = dict()
+
+    @contextmanager
+    def measure(self, name, count=1):
+        """
+        Measure a block of code
+
+        :param count: how many items the block handles
+        :return: dict with the item count, which the block can update
+        """
+        run = {"count": count}
+        start = time.perf_counter()
+        yield run
+        self.timings.setdefault(name, []).append(
+            ((time.perf_counter() - start), run["count"])
+        )
+
+    def get_summary(self):
+        """
+        Summarize the timings
+
+        :return: dict of name: dict of total and median seconds, and
+            items per second
+        """
+        summary = dict()
+        for name, timings in self.timings.items():
+            total = sum(seconds for seconds, count in timings)
+            count = sum(count for seconds, count in timings)
+            summary[name] = {
+                "runs": len(timings),
+                "items": count,
+                "total_s": round(total, 3),
+                "median_s": round(median(seconds for seconds, count in timings), 4),
+                "per_second": round(count / total, 2) if total else 0,
+            }
+
+        return summary
+
+    def __str__(self):
+        lines = []
+        for name, values in self.get_summary().items():
+            lines.append(
+                "{name}: {items} items in {total_s} s "
+                "({per_second}/s, median {median_s} s)".format(name=name, **values)
+            )
+
+        return "\n".join(lines)
+
+
+def get_benchmark_invoices(env, backend, invoices):
+    # Returns posted customer invoices of the backend company
+    return env["account.move"].search(
+        [
+            ("company_id", "=", backend.company_id.id),
+            ("move_type", "=", "out_invoice"),
+            ("state", "=", "posted"),
+        ],
+        limit=invoices,
+    )
+
+
+def benchmark_payload(result, moves):
+    # Payload build time for each invoice
+    for move in moves:
+        with result.measure("payload"):
+            payload = move.get_apix_payload()
+        payload.close()
+
+
+def benchmark_send(result, moves):
+    # End-to-end send through the send pipeline. The upload and record
+    # stages run right away instead of being queued
+    moves = moves.with_context(queue_job__no_delay=True)
+    with result.measure("send", count=len(moves)):
+        for move in moves:
+            move.einvoice_send_package()
+
+
+def benchmark_list(result, backend, refetch=False):
+    # Listing the inbox and creating the inbox documents
+    Document = backend.env["apix.inbox.document"].sudo()
+    last_document = Document.search([], limit=1, order="id desc")
+
+    with result.measure("list") as run:
+        backend.list_invoices(refetch=refetch)
+        documents = Document.search(
+            [
+                ("backend_id", "=", backend.id),
+                ("id", ">", last_document.id or 0),
+                ("state", "=", "queued"),
+            ]
+        )
+        run["count"] = len(documents)
+
+    return documents
+
+
+def benchmark_download(result, backend, documents):
+    # Download and import of the invoices, the way the jobs run them
+    with result.measure("download", count=len(documents)):
+        backend.download_invoices(documents.ids)
+
+    downloaded = documents.filtered(lambda d: d.state == "downloaded")
+    with result.measure("import", count=len(downloaded)):
+        backend.ingest_documents(downloaded.ids)
+
+
+def cleanup_outbox(env, backend, last_outbox_id):
+    # Removes the outbox entries of the run. They are committed in separate
+    # transactions, and would make later runs skip sending the invoices
+    with env.registry.cursor() as cr:
+        env(cr=cr)["apix.outbox"].sudo().search(
+            [("backend_id", "=", backend.id), ("id", ">", last_outbox_id)]
+        ).unlink()
+
+
+def run(env, backend, invoices=10, send=True, download=True, refetch=False):
+    """
+    Run the benchmarks. Changes are rolled back, except the statistics
+    the connector commits in separate transactions
+
+    :param env: Odoo environment
+    :param backend: apix.backend to benchmark
+    :param invoices: how many invoices to send and download
+    :param send: benchmark sending. Needs posted customer invoices
+    :param download: benchmark listing and downloading
+    :param refetch: also download the invoices already marked received
+    :return: BenchmarkResult
+    """
+    result = BenchmarkResult()
+    last_outbox = env["apix.outbox"].sudo().search([], limit=1, order="id desc")
+
+    try:
+        with result.measure("authenticate"):
+            backend.action_authenticate()
+
+        if send:
+            moves = get_benchmark_invoices(env, backend, invoices)
+            if not moves:
+                _logger.warning("No posted customer invoices to send")
+            benchmark_payload(result, moves)
+            benchmark_send(result, moves)
+
+        if download:
+            documents = benchmark_list(result, backend, refetch=refetch)
+            benchmark_download(result, backend, documents[:invoices])
+    finally:
+        env.cr.rollback()
+        if send:
+            cleanup_outbox(env, backend, last_outbox.id or 0)
+
+    _logger.info(f"APIX benchmark results:\n{result}")
+
+    return result
@@ -0,0 +1,311 @@
+"""
+A local stand-in for the APIX REST API, for benchmarking without APIX.
+
+Implements app-transferID, authuser, invoices, list2, metadata and download with
+configurable latency, error rate and payload sizes. Run with
+
+    python -m odoo.addons.connector_apix.tools.fake_apix --port 8765
+
+or directly as a script, and set the backend environment to "Custom" with
+http://localhost:8765 as both the API and the terminal URL.
+"""
+import argparse
+import logging
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlsplit
+from xml.sax.saxutils import escape
+from zipfile import ZIP_DEFLATED, ZipFile
+
+_logger = logging.getLogger(__name__)
+
+FINVOICE_TEMPLATE = """<?xml version="1.0" encoding="ISO-8859-15"?>
+<Finvoice Version="3.0">
+  <SellerPartyDetails>
+    <SellerPartyIdentifier>{business_id}</SellerPartyIdentifier>
+    <SellerOrganisationName>{sender_name}</SellerOrganisationName>
+    <SellerOrganisationTaxCode>FI{vat}</SellerOrganisationTaxCode>
+  </SellerPartyDetails>
+  <InvoiceDetails>
+    <InvoiceTypeCode>INV01</InvoiceTypeCode>
+    <InvoiceDate Format="CCYYMMDD">20240101</InvoiceDate>
+    <InvoiceNumber>{invoice_number}</InvoiceNumber>
+    <InvoiceTotalVatExcludedAmount AmountCurrencyIdentifier="EUR">100,00\
+</InvoiceTotalVatExcludedAmount>
+    <InvoiceTotalVatIncludedAmount AmountCurrencyIdentifier="EUR">125,50\
+</InvoiceTotalVatIncludedAmount>
+  </InvoiceDetails>
+  <InvoiceRow>
+    <ArticleName>Benchmark row</ArticleName>
+    <DeliveredQuantity QuantityUnitCode="pcs">1</DeliveredQuantity>
+    <UnitPriceAmount AmountCurrencyIdentifier="EUR">100,00</UnitPriceAmount>
+    <RowVatRatePercent>25,5</RowVatRatePercent>
+    <RowVatExcludedAmount AmountCurrencyIdentifier="EUR">100,00\
+</RowVatExcludedAmount>
+  </InvoiceRow>
+</Finvoice>
+"""
+
+
+def get_response_xml(groups=(), status="OK", status_code="1000", free_text="OK"):
+    """
+    Build an APIX style XML response
+
+    :param groups: iterable of dicts, one Group for each
+    :return: bytes
+    """
+    content = []
+    for values in groups:
+        content.append("<Group>")
+        for key, value in values.items():
+            content.append(f'<Value type="{key}">{escape(str(value))}</Value>')
+        content.append("</Group>")
+
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        f"<Response><Status>{status}</Status><StatusCode>{status_code}"
+        f"</StatusCode><FreeText>{escape(free_text)}</FreeText>"
+        f"<Content>{''.join(content)}</Content></Response>"
+    ).encode("utf-8")
+
+
+def get_invoice_zip(index, attachment_size):
+    """
+    Build an invoice zip like the ones APIX returns from download
+
+    :param index: inbox index of the invoice, used for unique values
+    :param attachment_size: size of the attachment in bytes
+    :return: bytes
+    """
+    business_id = "%07d" % (1000000 + index % 1000)
+    finvoice = FINVOICE_TEMPLATE.format(
+        business_id=f"{business_id[:7]}-{index % 10}",
+        vat=business_id + str(index % 10),
+        sender_name=f"Supplier {index % 1000}",
+        invoice_number=f"BENCH-{index}",
+    )
+
+    content = BytesIO()
+    with ZipFile(content, "w", ZIP_DEFLATED) as zip_file:
+        zip_file.writestr("invoice.xml", finvoice.encode("iso-8859-15"))
+        if attachment_size:
+            # Random data doesn't compress, like the real attachments
+            zip_file.writestr("attachment.pdf", random.randbytes(attachment_size))
+
+    return content.getvalue()
+
+
+class FakeApixState:
+    # Shared state of the fake server
+    def __init__(self, invoices=10, latency=0.0, error_rate=0.0, attachment_size=0):
+        self.invoices = invoices
+        self.latency = latency
+        self.error_rate = error_rate
+        self.attachment_size = attachment_size
+        self.lock = threading.Lock()
+        self.received = set()
+        self.uploads = 0
+        self.uploaded_bytes = 0
+
+    def get_inbox(self):
+        # Returns the list2 groups of the invoices. Received invoices stay
+        # listed, like in APIX, so they can be fetched again
+        return [
+            {
+                "StorageID": f"storage-{index}",
+                "StorageKey": f"key-{index}",
+                "StorageStatus": (
+                    "RECEIVED" if index in self.received else "UNRECEIVED"
+                ),
+                "DocumentID": f"BENCH-{index}",
+                "SenderName": f"Supplier {index % 1000}",
+                "DocumentType": "INVOICE",
+            }
+            for index in range(self.invoices)
+        ]
+
+
+class FakeApixHandler(BaseHTTPRequestHandler):
+    server_version = "FakeApix/1.0"
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def log_message(self, format, *args):
+        _logger.debug(format, *args)
+
+    def do_GET(self):
+        self.handle_command()
+
+    def do_PUT(self):
+        self.handle_command()
+
+    def handle_command(self):
+        url = urlsplit(self.path)
+        command = url.path.strip("/")
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        # Consume the request body before answering
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+
+        if self.state.latency:
+            time.sleep(self.state.latency)
+
+        if random.random() < self.state.error_rate:
+            return self.respond(b"Service unavailable", status=503)
+
+        handler = getattr(self, "command_" + command.replace("-", "_"), None)
+        if not handler:
+            return self.respond(b"Not found", status=404)
+
+        return handler(params, body)
+
+    def respond(self, body, status=200, content_type="text/xml"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def command_app_transferID(self, params, body):
+        groups = [
+            {
+                "TransferID": uuid.uuid4().hex,
+                "TransferKey": uuid.uuid4().hex,
+                "UniqueCompanyID": uuid.uuid4().hex,
+            }
+        ]
+        self.respond(get_response_xml(groups))
+
+    def command_authuser(self, params, body):
+        groups = [
+            {
+                "IdCustomer": "1",
+                "CustomerNumber": "1000",
+                "ContactPerson": "Benchmark",
+                "Email": "benchmark@example.com",
+                "OwnerId": "1",
+            }
+        ]
+        self.respond(get_response_xml(groups))
+
+    def command_invoices(self, params, body):
+        try:
+            with ZipFile(BytesIO(body)) as zip_file:
+                # Each Finvoice in the payload is one document
+                documents = [
+                    name for name in zip_file.namelist() if name.endswith(".xml")
+                ]
+        except Exception as error:
+            xml = get_response_xml(
+                status="ERR", status_code="5000", free_text=str(error)
+            )
+            return self.respond(xml)
+
+        with self.state.lock:
+            self.state.uploads += 1
+            self.state.uploaded_bytes += len(body)
+
+        groups = [{"BatchID": uuid.uuid4().hex, "CostInCredits": len(documents)}]
+        groups += [{"AcceptedDocumentID": uuid.uuid4().hex} for name in documents]
+        self.respond(get_response_xml(groups))
+
+    def command_list2(self, params, body):
+        self.respond(get_response_xml(self.state.get_inbox()))
+
+    def command_metadata(self, params, body):
+        storage_id = params.get("SID", "")
+        try:
+            index = int(storage_id.rsplit("-", 1)[-1])
+        except ValueError:
+            return self.respond(b"Not found", status=404)
+
+        groups = [
+            {
+                "StorageID": storage_id,
+                "DocumentID": f"BENCH-{index}",
+                "SenderName": f"Supplier {index % 1000}",
+                "SenderYtunnus": "%07d-%d" % (1000000 + index % 1000, index % 10),
+                # Roughly the size of the zip from download
+                "FileSize": self.state.attachment_size + 1024,
+            }
+        ]
+        self.respond(get_response_xml(groups))
+
+    def command_download(self, params, body):
+        storage_id = params.get("SID", "")
+        try:
+            index = int(storage_id.rsplit("-", 1)[-1])
+        except ValueError:
+            return self.respond(b"Not found", status=404)
+
+        if params.get("markReceived") == "yes":
+            with self.state.lock:
+                self.state.received.add(index)
+
+        self.respond(
+            get_invoice_zip(index, self.state.attachment_size),
+            content_type="application/zip",
+        )
+
+
+def get_server(port=8765, **kwargs):
+    """
+    Create a fake APIX server. Keyword arguments are passed to FakeApixState
+
+    :return: http.server.ThreadingHTTPServer, serve with serve_forever()
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeApixHandler)
+    server.state = FakeApixState(**kwargs)
+
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--invoices", type=int, default=10, help="invoices in the inbox"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds added to each request"
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="share of requests answered with 503, between 0 and 1",
+    )
+    parser.add_argument(
+        "--attachment-size",
+        type=int,
+        default=0,
+        help="size of the attachment in downloaded invoices in bytes",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = get_server(
+        port=args.port,
+        invoices=args.invoices,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        attachment_size=args.attachment_size,
+    )
+    _logger.info(f"Fake APIX listening on http://127.0.0.1:{args.port}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+import hashlib
+
+
+def get_identity_key(name, *values):
+    """
+    Build a deterministic identity key for a queue job, so the queue
+    doesn't get the same job twice. Lists of ids are hashed to keep
+    the key short, e.g. get_identity_key("apix-download", 1, [3, 2])
+
+    :param name: job name
+    :param values: ids or lists of ids identifying the job
+    :return: the identity key
+    """
+    parts = [name]
+    for value in values:
+        if isinstance(value, (list, tuple, set)):
+            ids = ",".join(str(item) for item in sorted(value))
+            value = hashlib.sha1(ids.encode("utf-8")).hexdigest()[:16]
+        parts.append(str(value))
+
+    return "-".join(parts)
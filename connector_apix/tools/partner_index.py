@@ -0,0 +1,101 @@
+import re
+
+# Finnish business id, e.g. 1234567-8
+BUSINESS_ID_RE = re.compile(r"^(\d{7})-?(\d)$")
+
+
+def normalize(value):
+    # Returns an identifier without separators, in upper case
+    return re.sub(r"[\s.-]", "", value or "").upper()
+
+
+def get_business_keys(value):
+    """
+    Get the index keys of a business id or a VAT number.
+    A Finnish business id matches the corresponding VAT number
+
+    :return: list of normalized identifiers
+    """
+    if not value:
+        return []
+
+    keys = [normalize(value)]
+    match = BUSINESS_ID_RE.match(value.strip())
+    if match:
+        keys.append("FI" + "".join(match.groups()))
+
+    return keys
+
+
+def get_finvoice_partner_keys(tree):
+    """
+    Get the seller identifiers of a Finvoice document
+
+    :param tree: parsed Finvoice document
+    :return: dict of vat, business_code, edicodes and ibans
+    """
+    edicodes = [
+        tree.findtext("SellerOrganisationUnitNumber"),
+        tree.findtext("MessageTransmissionDetails/MessageSenderDetails/FromIdentifier"),
+    ]
+    ibans = [
+        account.text
+        for account in tree.iterfind(
+            "SellerInformationDetails/SellerAccountDetails/SellerAccountID"
+        )
+    ]
+
+    return {
+        "vat": tree.findtext("SellerPartyDetails/SellerOrganisationTaxCode"),
+        "business_code": tree.findtext("SellerPartyDetails/SellerPartyIdentifier"),
+        "edicodes": [edicode for edicode in edicodes if edicode],
+        "ibans": [iban for iban in ibans if iban],
+    }
+
+
+class PartnerIndex:
+    """
+    Supplier lookup by business id, VAT number, edicode (OVT) and IBAN.
+
+    Built once for an import batch, so matching each document is a few
+    dict lookups instead of searches
+    """
+
+    def __init__(self):
+        self._partners = dict()
+
+    def add(self, kind, value, partner_id):
+        """
+        Add an identifier of a partner. The first partner added for an
+        identifier wins, so add the preferred partners first
+
+        :param kind: "business", "edicode" or "iban"
+        """
+        keys = get_business_keys(value) if kind == "business" else [normalize(value)]
+        for key in keys:
+            if key:
+                self._partners.setdefault((kind, key), partner_id)
+
+    def lookup(self, vat=None, business_code=None, edicodes=(), ibans=()):
+        """
+        Find a partner by the business id or the VAT number.
+        Edicodes and IBANs are used only for documents without either,
+        as they can be shared by different companies
+
+        :return: partner id or None
+        """
+        candidates = [("business", key) for key in get_business_keys(vat)]
+        candidates += [("business", key) for key in get_business_keys(business_code)]
+        if not candidates:
+            candidates += [("edicode", normalize(edicode)) for edicode in edicodes]
+            candidates += [("iban", normalize(iban)) for iban in ibans]
+
+        for candidate in candidates:
+            partner_id = self._partners.get(candidate)
+            if partner_id:
+                return partner_id
+
+        return None
+
+    def __len__(self):
+        return len(self._partners)
@@ -0,0 +1,50 @@
+import logging
+
+from lxml import etree as ET
+
+_logger = logging.getLogger(__name__)
+
+
+def iter_groups(source):
+    """
+    Parse an APIX response incrementally, yielding one dict of
+    Value type: text for each Group.
+    Parsed groups are cleared right away, so memory use stays flat
+    regardless of the response size.
+
+    Only the first Value of each type is used
+
+    :param source: a file object or a file name
+    :return: generator of dicts
+    """
+    for _event, group in ET.iterparse(source, events=("end",), tag="Group"):
+        values = dict()
+        for value in group.iter("Value"):
+            values.setdefault(value.get("type"), value.text)
+
+        yield values
+
+        # Free the group and the already handled siblings
+        group.clear()
+        while group.getprevious() is not None:
+            del group.getparent()[0]
+
+
+def get_credits(response):
+    """
+    Read the cost of a call from a parsed APIX response.
+    The cost is only informative, so a missing or malformed value
+    is logged and counted as zero instead of failing the call
+
+    :param response: response root element
+    :return: cost in credits as float
+    """
+    credits = response.find(".//Value[@type='CostInCredits']")
+    if credits is None or not credits.text:
+        return 0.0
+
+    try:
+        return float(credits.text)
+    except ValueError:
+        _logger.warning(f"APIX returned invalid CostInCredits '{credits.text}'")
+        return 0.0
@@ -0,0 +1,224 @@
+import logging
+import tempfile
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+_logger = logging.getLogger(__name__)
+
+# Retry only on errors that are safe to retry.
+# Connection errors are retried for every method (the request was never sent),
+# read errors and 5xx responses only for idempotent requests
+RETRY_STATUSES = (500, 502, 503, 504)
+RETRY_METHODS = frozenset(["GET", "HEAD"])
+
+# Sessions are shared inside one worker process:
+# one session for each (database, backend, host)
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+# Downloads bigger than this are spooled to disk
+DOWNLOAD_SPOOL_SIZE = 8 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class ApixSession(requests.Session):
+    """A keep-alive session with a bounded connection pool for one APIX host"""
+
+    def __init__(self, pool_size=4, max_retries=3, backoff_factor=0.5):
+        super().__init__()
+
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=max_retries,
+            status=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=RETRY_METHODS,
+            raise_on_status=False,
+        )
+        self.adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            max_retries=retry,
+        )
+        self.mount("https://", self.adapter)
+        self.mount("http://", self.adapter)
+
+        self.request_count = 0
+        self.error_count = 0
+
+    def request(self, method, url, *args, **kwargs):
+        self.request_count += 1
+        try:
+            return super().request(method, url, *args, **kwargs)
+        except requests.RequestException:
+            self.error_count += 1
+            raise
+
+    def get_stats(self):
+        connections = 0
+        pool_requests = 0
+
+        pools = self.adapter.poolmanager.pools
+        for pool_key in pools.keys():
+            pool = pools.get(pool_key)
+            if pool is None:
+                continue
+            connections += pool.num_connections
+            pool_requests += pool.num_requests
+
+        return {
+            "requests": self.request_count,
+            "errors": self.error_count,
+            "connections": connections,
+            "reused": max(pool_requests - connections, 0),
+        }
+
+
+class UploadBody:
+    """
+    A request body streamed from a file object.
+
+    The length is known up front, so the upload is sent in chunks with a
+    Content-Length header. This also keeps requests from calling fileno(),
+    which would move a spooled temporary file to disk
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+
+        position = fileobj.tell()
+        fileobj.seek(0, 2)
+        self.length = fileobj.tell()
+        fileobj.seek(position)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        while True:
+            chunk = self.fileobj.read(self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def read(self, size=-1):
+        return self.fileobj.read(size)
+
+    def tell(self):
+        return self.fileobj.tell()
+
+    def seek(self, offset, whence=0):
+        return self.fileobj.seek(offset, whence)
+
+
+def get_session(dbname, backend_id, url, pool_size, max_retries, backoff_factor):
+    """
+    Return the pooled session for a backend and the host of the url.
+    A new session is created if the pool configuration has changed
+
+    :return: ApixSession
+    """
+    host = urlsplit(url).netloc
+    key = (dbname, backend_id, host)
+    config = (pool_size, max_retries, backoff_factor)
+
+    with _sessions_lock:
+        session_config, session = _sessions.get(key, (None, None))
+        if session is None or session_config != config:
+            if session is not None:
+                session.close()
+
+            _logger.debug("Creating APIX session for %s (%s)", host, config)
+            session = ApixSession(pool_size, max_retries, backoff_factor)
+            _sessions[key] = (config, session)
+
+    return session
+
+
+def spool_response(response):
+    """
+    Read a streamed response to a spooled temporary file and close it
+
+    :param response: requests.Response requested with stream=True
+    :return: a file object positioned at the start of the content
+    """
+    content = tempfile.SpooledTemporaryFile(max_size=DOWNLOAD_SPOOL_SIZE)
+    try:
+        for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+            content.write(chunk)
+    except Exception:
+        content.close()
+        raise
+    finally:
+        response.close()
+
+    content.seek(0)
+
+    return content
+
+
+def read_and_discard(session, url, timeout):
+    """
+    Request an url and read the content without keeping it.
+    Safe to run in a thread, as it doesn't touch the ORM
+
+    :return: requests.Response
+    """
+    response = session.get(url, timeout=timeout, stream=True)
+    try:
+        response.raise_for_status()
+        for _chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+            pass
+    finally:
+        response.close()
+
+    return response
+
+
+def fetch_content(session, url, timeout):
+    """
+    Download the contents of an url to a spooled temporary file.
+    Safe to run in a thread, as it doesn't touch the ORM
+
+    :return: tuple of requests.Response and the content file object
+    """
+    response = session.get(url, timeout=timeout, stream=True)
+    try:
+        response.raise_for_status()
+    except Exception:
+        response.close()
+        raise
+
+    return response, spool_response(response)
+
+
+def get_session_stats(dbname, backend_id):
+    """
+    Return the statistics of all the sessions of a backend in this worker
+
+    :return: dict of host: stats
+    """
+    with _sessions_lock:
+        sessions = [
+            (key[2], session)
+            for key, (_config, session) in _sessions.items()
+            if key[0] == dbname and key[1] == backend_id
+        ]
+
+    return {host: session.get_stats() for host, session in sessions}
+
+
+def close_sessions(dbname, backend_id):
+    """Close and forget all the sessions of a backend in this worker"""
+    with _sessions_lock:
+        for key in [k for k in _sessions if k[0] == dbname and k[1] == backend_id]:
+            _config, session = _sessions.pop(key)
+            session.close()
@@ -0,0 +1,75 @@
+import datetime
+import hashlib
+import logging
+from urllib.parse import quote, urlencode
+
+_logger = logging.getLogger(__name__)
+
+
+class ApixSigner:
+    """
+    Signs APIX requests for one backend.
+
+    The password hash is calculated once, and the timestamp once per second,
+    so signing many requests (e.g. downloads) only costs one digest each
+    """
+
+    # Characters that are kept as is in the query string
+    SAFE_CHARACTERS = ":"
+
+    _timestamp = (None, "")
+
+    def __init__(self, password):
+        password = (password or "").encode("utf-8")
+        self.password_hash = hashlib.sha256(password).hexdigest()
+
+    @classmethod
+    def get_timestamp(cls):
+        # Returns the timestamp in the correct format for the REST API
+        now = datetime.datetime.today().replace(microsecond=0)
+
+        second, timestamp = cls._timestamp
+        if second != now:
+            timestamp = now.strftime("%Y%m%d%H%M%S")
+            cls._timestamp = (now, timestamp)
+
+        return timestamp
+
+    @staticmethod
+    def get_digest(values):
+        """
+        Calculate the digest of the request values
+
+        :param values: OrderedDict, in the order APIX expects
+        :return: the digest
+        """
+        digest_src = "+".join(values.values())
+        _logger.debug("Calculating digest from %s" % digest_src)
+
+        return "SHA-256:" + hashlib.sha256(digest_src.encode("utf-8")).hexdigest()
+
+    def sign(self, values, secret_keys=()):
+        """
+        Add the digest to the request values
+
+        :param values: OrderedDict, in the order APIX expects
+        :param secret_keys: keys that are part of the digest,
+            but must not be sent
+        :return: the values to send
+        """
+        values["d"] = self.get_digest(values)
+
+        for key in secret_keys:
+            values.pop(key, None)
+
+        return values
+
+    @classmethod
+    def get_query(cls, values):
+        """
+        Build an URL-encoded query string, keeping the order of the values
+
+        :param values: dict of the query parameters
+        :return: the query string
+        """
+        return urlencode(values, safe=cls.SAFE_CHARACTERS, quote_via=quote)